@@ -0,0 +1,107 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+
+class ActivityPipeline:
+    """Process message activity off the event loop, in queues sharded by user_id"""
+    
+    def __init__(self, economy, num_workers=None, max_queue_size=None, overflow_policy=None, tick=None):
+        self.economy = economy
+        self.num_workers = num_workers or config.ACTIVITY_WORKERS
+        self.max_queue_size = max_queue_size or config.ACTIVITY_QUEUE_MAXSIZE
+        self.overflow_policy = overflow_policy or config.ACTIVITY_OVERFLOW_POLICY
+        self.tick = config.ACTIVITY_TICK if tick is None else tick
+        
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='activity')
+        # Each shard's worker hands its events to the pool one at a time, so a
+        # user's events are applied in order
+        self.queues = [asyncio.Queue() for _ in range(self.num_workers)]
+        # Events still waiting in each shard's queue, by user_id
+        self.queued_events = [{} for _ in range(self.num_workers)]
+        self.workers = []
+        
+        self.stats = {
+            'submitted': 0,
+            'processed': 0,
+            'dropped': 0,
+            'coalesced': 0,
+            'errors': 0,
+            'max_depth': 0
+        }
+    
+    def start(self):
+        """Start the shard workers on the running event loop"""
+        if self.workers:
+            return
+        self.workers = [asyncio.create_task(self._worker(shard)) for shard in range(self.num_workers)]
+    
+    def submit(self, user_id, message_content):
+        """Queue a message for processing without blocking. Returns False if it was dropped."""
+        shard = user_id % self.num_workers
+        queue = self.queues[shard]
+        self.stats['submitted'] += 1
+        # The spam checks use when the message arrived, not when it's processed
+        message = (time.time(), message_content)
+        
+        # With a tick, or a full queue under the 'coalesce' policy, the message
+        # is folded into the user's event that's already waiting
+        event = self.queued_events[shard].get(user_id)
+        if event is not None and (self.tick > 0 or
+                                  (queue.qsize() >= self.max_queue_size and self.overflow_policy == 'coalesce')):
+            event['messages'].append(message)
+            self.stats['coalesced'] += 1
+            return True
+        
+        if queue.qsize() >= self.max_queue_size:
+            self.stats['dropped'] += 1
+            return False
+        
+        event = {
+            'user_id': user_id,
+            'messages': [message],
+            'due': asyncio.get_running_loop().time() + self.tick
+        }
+        self.queued_events[shard][user_id] = event
+        queue.put_nowait(event)
+        self.stats['max_depth'] = max(self.stats['max_depth'], queue.qsize())
+        return True
+    
+    async def _worker(self, shard):
+        queue = self.queues[shard]
+        queued_events = self.queued_events[shard]
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            event = await queue.get()
+            user_id = event['user_id']
+            
+            # Give the tick time to collect more messages from this user
+            delay = event['due'] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            # Once picked up the event can no longer absorb new messages
+            if queued_events.get(user_id) is event:
+                del queued_events[user_id]
+            
+            try:
+                await loop.run_in_executor(self.executor, self._process_event, event)
+                self.stats['processed'] += len(event['messages'])
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error updating user activity: {e}")
+            finally:
+                queue.task_done()
+    
+    def _process_event(self, event):
+        self.economy.update_user_activity_batch(event['user_id'], event['messages'])
+    
+    def get_stats(self):
+        """Get pipeline counters and the current depth of each shard"""
+        return {
+            **self.stats,
+            'depth': sum(queue.qsize() for queue in self.queues),
+            'shard_depths': [queue.qsize() for queue in self.queues]
+        }
@@ -0,0 +1,102 @@
+class CandleStore:
+    """Hourly and daily OHLC candles for every user, rolled up from flushed history points"""
+    
+    RESOLUTIONS = {'hour': 3600, 'day': 86400}
+    
+    def __init__(self):
+        # resolution -> user_id -> {start: candle}
+        self.candles = {resolution: {} for resolution in self.RESOLUTIONS}
+        # Cumulative message count at each user's latest point, for volumes
+        self.last_counts = {}
+        self.dirty_keys = set()
+        # Keys of pruned candles still to be deleted from storage
+        self.removed_keys = set()
+    
+    def __len__(self):
+        return sum(len(candles) for by_user in self.candles.values() for candles in by_user.values())
+    
+    @staticmethod
+    def key(resolution, user_id, start):
+        return f"{resolution}:{user_id}:{start}"
+    
+    def load(self, records):
+        """Rebuild the store from stored candle records"""
+        self.candles = {resolution: {} for resolution in self.RESOLUTIONS}
+        self.last_counts = {}
+        self.dirty_keys = set()
+        self.removed_keys = set()
+        for record in sorted(records, key=lambda record: record['start']):
+            by_user = self.candles[record['resolution']].setdefault(record['user_id'], {})
+            by_user[record['start']] = record
+            self.last_counts[record['user_id']] = record['message_count']
+    
+    def add_point(self, user_id, timestamp, price, message_count):
+        """Roll a history point up into the user's hourly and daily candles"""
+        previous_count = self.last_counts.get(user_id)
+        volume = 1 if previous_count is None else max(0, message_count - previous_count)
+        self.last_counts[user_id] = message_count
+        
+        for resolution, seconds in self.RESOLUTIONS.items():
+            start = int(timestamp // seconds * seconds)
+            by_user = self.candles[resolution].setdefault(user_id, {})
+            candle = by_user.get(start)
+            if candle is None:
+                self.removed_keys.discard(self.key(resolution, user_id, start))
+                by_user[start] = {
+                    'user_id': user_id,
+                    'resolution': resolution,
+                    'start': start,
+                    'open': price,
+                    'high': price,
+                    'low': price,
+                    'close': price,
+                    'volume': volume,
+                    'message_count': message_count
+                }
+            else:
+                candle['high'] = max(candle['high'], price)
+                candle['low'] = min(candle['low'], price)
+                candle['close'] = price
+                candle['volume'] += volume
+                candle['message_count'] = message_count
+            self.dirty_keys.add(self.key(resolution, user_id, start))
+    
+    def get_candles(self, user_id, resolution, start):
+        """Get a user's candles starting at or after start, oldest first"""
+        by_user = self.candles[resolution].get(user_id, {})
+        return [by_user[candle_start] for candle_start in sorted(by_user) if candle_start >= start]
+    
+    def prune(self, resolution, cutoff):
+        """Drop candles that ended before cutoff, queueing their keys for removal, and return the keys"""
+        seconds = self.RESOLUTIONS[resolution]
+        removed = []
+        for user_id, by_user in self.candles[resolution].items():
+            for start in [start for start in by_user if start + seconds <= cutoff]:
+                del by_user[start]
+                key = self.key(resolution, user_id, start)
+                self.dirty_keys.discard(key)
+                removed.append(key)
+        self.removed_keys.update(removed)
+        return removed
+    
+    def take_changes(self):
+        """Get {key: candle} copies of the changed candles and clear the change set"""
+        changes = {}
+        for key in self.dirty_keys:
+            resolution, user_id, start = key.split(':')
+            changes[key] = dict(self.candles[resolution][int(user_id)][int(start)])
+        self.dirty_keys = set()
+        return changes
+    
+    def restore_changes(self, changes):
+        """Mark candles from a failed write as changed again"""
+        self.dirty_keys.update(changes)
+    
+    def take_removed(self):
+        """Get the keys of pruned candles still to be removed from storage and clear them"""
+        removed, self.removed_keys = self.removed_keys, set()
+        return removed
+    
+    def restore_removed(self, keys):
+        """Queue the keys from a failed removal again"""
+        self.removed_keys.update(keys)
@@ -0,0 +1,201 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import config
+
+
+def downsample_lttb(timestamps, values, max_points, keep=()):
+    """Pick the indices of about max_points points that preserve the series' shape, always including keep"""
+    n = len(values)
+    if n <= max_points or max_points < 3:
+        return np.unique(np.concatenate((np.arange(n), np.asarray(keep, dtype=np.int64))))
+    
+    x = np.asarray(timestamps, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    
+    # Largest-Triangle-Three-Buckets: each bucket keeps the point forming the
+    # largest triangle with the previously kept point and the next bucket's average
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    
+    return np.unique(np.concatenate((selected, np.asarray(keep, dtype=np.int64))))
+
+
+def render_stock_chart(display_name, days, timestamps, values):
+    """Render a stock performance chart with trend line and return it as PNG bytes"""
+    # Find the points to label on the full series, then thin it out to the
+    # pixel budget while keeping them
+    labeled = []
+    if len(values) > 5:
+        labeled = [0, len(values)-1, values.index(max(values)), values.index(min(values))]
+    indices = downsample_lttb(timestamps, values, config.CHART_MAX_POINTS, labeled).tolist()
+    dates = [datetime.fromtimestamp(timestamps[i]) for i in indices]
+    sampled_values = [values[i] for i in indices]
+    
+    # Create the plot
+    fig = Figure(figsize=(12, 7))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    
+    # Plot actual values
+    ax.plot(dates, sampled_values, marker='o', linestyle='-', linewidth=2, markersize=4, label='Actual Price')
+    
+    # Add trend line (linear regression)
+    if len(values) > 1:
+        x = np.arange(len(values))
+        z = np.polyfit(x, values, 1)
+        p = np.poly1d(z)
+        ax.plot(dates, p(np.array(indices)), "r--", alpha=0.7, linewidth=1.5, label='Trend Line')
+    
+    # Format the plot
+    ax.set_title(f"{display_name}'s Stock Performance (Last {days} Days)")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Stock Value ($)")
+    ax.grid(True, alpha=0.3)
+    ax.legend()
+    
+    # Format x-axis to show dates nicely
+    fig.autofmt_xdate()
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=max(1, days//7)))
+    
+    # Add value labels to some points
+    positions = {index: position for position, index in enumerate(indices)}
+    for i in set(labeled):
+        position = positions[i]
+        ax.annotate(f"${values[i]:.2f}",
+                    (dates[position], values[i]),
+                    textcoords="offset points",
+                    xytext=(0,10),
+                    ha='center')
+    
+    # Save to bytes buffer
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    return buf.getvalue()
+
+
+def render_candle_chart(display_name, days, resolution, candles):
+    """Render an OHLC candlestick chart with a volume panel and return it as PNG bytes"""
+    seconds = 3600 if resolution == 'hour' else 86400
+    # Candle widths are in days, matplotlib's date unit
+    width = seconds / 86400 * 0.7
+    centers = mdates.date2num([datetime.fromtimestamp(candle['start'] + seconds / 2) for candle in candles])
+    opens = np.array([candle['open'] for candle in candles])
+    closes = np.array([candle['close'] for candle in candles])
+    rising = closes >= opens
+    colors = np.where(rising, 'tab:green', 'tab:red')
+    
+    fig = Figure(figsize=(12, 7))
+    FigureCanvasAgg(fig)
+    ax, volume_ax = fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+    
+    # Wicks span the low to high, bodies the open to close
+    ax.vlines(centers, [candle['low'] for candle in candles], [candle['high'] for candle in candles],
+              colors=colors, linewidth=1)
+    ax.bar(centers, np.maximum(np.abs(closes - opens), 1e-3), width, bottom=np.minimum(opens, closes),
+           color=colors)
+    volume_ax.bar(centers, [candle['volume'] for candle in candles], width, color=colors, alpha=0.6)
+    
+    # Format the plot
+    label = 'Hourly' if resolution == 'hour' else 'Daily'
+    ax.set_title(f"{display_name}'s Stock Performance (Last {days} Days, {label} Candles)")
+    ax.set_ylabel("Stock Value ($)")
+    ax.grid(True, alpha=0.3)
+    volume_ax.set_ylabel("Messages")
+    volume_ax.set_xlabel("Date")
+    volume_ax.grid(True, alpha=0.3)
+    
+    # Format x-axis to show dates nicely
+    fig.autofmt_xdate()
+    volume_ax.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
+    volume_ax.xaxis.set_major_locator(mdates.DayLocator(interval=max(1, days//7)))
+    
+    # Save to bytes buffer
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    return buf.getvalue()
+
+
+class ChartRenderer:
+    """Render charts in a process pool and keep recent PNGs in an LRU cache, keyed by what they were drawn from"""
+    
+    def __init__(self, max_workers=None, cache_size=None):
+        self.max_workers = max_workers or config.CHART_RENDER_WORKERS
+        self.cache_size = cache_size or config.CHART_CACHE_SIZE
+        self.executor = None
+        self.cache = OrderedDict()
+    
+    def _create_executor(self):
+        # Workers only need this module, so fork them where possible rather
+        # than spawning processes that would re-import the bot
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = None
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+    
+    def start(self):
+        """Create the worker processes now rather than on the first chart"""
+        if self.executor is not None:
+            return
+        # The bot calls this before any other thread exists, since a forked
+        # worker inherits every lock another thread was holding
+        self._create_executor()
+        # A forking pool starts all its workers on the first submit, so one
+        # round trip per worker forks them all here
+        for future in [self.executor.submit(os.getpid) for _ in range(self.max_workers)]:
+            future.result()
+    
+    def get_cached(self, key):
+        """Get a cached chart PNG, or None"""
+        png = self.cache.get(key)
+        if png is not None:
+            self.cache.move_to_end(key)
+        return png
+    
+    async def render(self, key, render_function, *args):
+        """Get the chart PNG for key, calling render_function(*args) off the event loop if needed"""
+        png = self.get_cached(key)
+        if png is not None:
+            return png
+        
+        loop = asyncio.get_running_loop()
+        self.start()
+        executor = self.executor
+        try:
+            png = await loop.run_in_executor(executor, render_function, *args)
+        except BrokenProcessPool:
+            # A worker died, which breaks the whole pool, so replace it (unless
+            # another render already has) and retry once
+            if self.executor is executor:
+                print("Chart worker died, restarting the render pool")
+                executor.shutdown(wait=False)
+                self._create_executor()
+            png = await loop.run_in_executor(self.executor, render_function, *args)
+        
+        self.cache[key] = png
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return png
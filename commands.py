@@ -1,10 +1,12 @@
 import discord
 from discord import app_commands
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import io
-from datetime import datetime
-import numpy as np
+from charts import ChartRenderer, render_candle_chart, render_stock_chart
+from user_resolver import UserResolver
+from utils import send_response
+
+user_resolver = UserResolver()
+chart_renderer = ChartRenderer()
 
 # Existing commands (balance, buy, sell, portfolio, market, profile, chart) remain unchanged
 async def balance(interaction: discord.Interaction, economy):
@@ -15,6 +17,7 @@ async def balance(interaction: discord.Interaction, economy):
         return
         
     # Calculate trend
+    await economy.load_price_history([interaction.user.id])
     trend = economy.calculate_trend(interaction.user.id)
     trend_icon = "📈" if trend > 0 else "📉" if trend < 0 else "➡️"
     
@@ -83,6 +86,7 @@ async def sell(interaction: discord.Interaction, economy, member: discord.Member
 
 async def portfolio(interaction: discord.Interaction, economy):
     """View your investment portfolio with trends"""
+    await economy.load_price_history(economy.get_investment_subjects(interaction.user.id))
     portfolio = economy.get_portfolio(interaction.user.id)
     
     if not portfolio['investments']:
@@ -94,12 +98,13 @@ async def portfolio(interaction: discord.Interaction, economy):
         color=discord.Color.gold()
     )
     
+    names = await user_resolver.resolve_names(interaction, [inv['subject_id'] for inv in portfolio['investments']])
+    
     for investment in portfolio['investments']:
-        user = await interaction.client.fetch_user(investment['subject_id'])
         trend_icon = "📈" if investment['trend'] > 0 else "📉" if investment['trend'] < 0 else "➡️"
         
         embed.add_field(
-            name=f"{user.display_name} {trend_icon}",
+            name=f"{names[investment['subject_id']]} {trend_icon}",
             value=f"Shares: {investment['shares']:.2f}\n" +
                   f"Current: ${investment['current_price']:.2f}\n" +
                   f"Value: ${investment['current_value']:.2f}\n" +
@@ -128,36 +133,33 @@ async def portfolio(interaction: discord.Interaction, economy):
         inline=False
     )
     
-    await interaction.response.send_message(embed=embed)
+    await send_response(interaction, embed=embed)
 
 async def market(interaction: discord.Interaction, economy, limit: int):
     """View top users by stock value with trends"""
-    users_cache = economy.users_cache
-    top_users = sorted(
-        users_cache.values(), 
-        key=lambda x: x['stock_value'], 
-        reverse=True
-    )[:limit]
+    top_users = economy.get_market_leaders(limit)
     
     embed = discord.Embed(
         title="Stock Market Leaders",
         color=discord.Color.purple()
     )
     
+    names = await user_resolver.resolve_names(interaction, [user['user_id'] for user in top_users])
+    await economy.load_price_history([user['user_id'] for user in top_users])
+    
     for i, user in enumerate(top_users, 1):
-        discord_user = await interaction.client.fetch_user(user['user_id'])
         trend = economy.calculate_trend(user['user_id'])
         trend_icon = "📈" if trend > 0 else "📉" if trend < 0 else "➡️"
         
         embed.add_field(
-            name=f"{i}. {discord_user.display_name} {trend_icon}",
+            name=f"{i}. {names[user['user_id']]} {trend_icon}",
             value=f"Value: ${user['stock_value']:.2f}\n" +
                   f"Messages: {user['message_count']}\n" +
                   f"Trend: {trend:+.2f}%",
             inline=False
         )
     
-    await interaction.response.send_message(embed=embed)
+    await send_response(interaction, embed=embed)
 
 async def profile(interaction: discord.Interaction, economy, member: discord.Member):
     """View a user's profile with detailed trend analysis"""
@@ -168,11 +170,12 @@ async def profile(interaction: discord.Interaction, economy, member: discord.Mem
         await interaction.response.send_message("User not found in the system!", ephemeral=True)
         return
         
-    # Get number of investors
-    investments = economy.data_handler.get_all_investments()
-    investor_count = sum(1 for inv in investments if inv.get('subject_id') == target.id)
+    # Get number of investors and market rank
+    investor_count = economy.get_investor_count(target.id)
+    rank, ranked_users = economy.get_market_rank(target.id)
     
     # Calculate trends
+    await economy.load_price_history([target.id])
     trend_7d = economy.calculate_trend(target.id, 7)
     trend_30d = economy.calculate_trend(target.id, 30)
     
@@ -190,6 +193,7 @@ async def profile(interaction: discord.Interaction, economy, member: discord.Mem
     embed.add_field(name="Stock Value", value=f"${user_data['stock_value']:.2f}", inline=True)
     embed.add_field(name="Message Count", value=user_data['message_count'], inline=True)
     embed.add_field(name="Investors", value=investor_count, inline=True)
+    embed.add_field(name="Market Rank", value=f"#{rank} of {ranked_users}" if rank else "Unranked", inline=True)
     embed.add_field(name="7-Day Trend", value=f"{trend_7d:+.2f}%", inline=True)
     embed.add_field(name="30-Day Trend", value=f"{trend_30d:+.2f}%", inline=True)
     embed.add_field(name="Tomorrow's Prediction", value=f"${tomorrow:.2f}", inline=True)
@@ -198,8 +202,8 @@ async def profile(interaction: discord.Interaction, economy, member: discord.Mem
     
     await interaction.response.send_message(embed=embed)
 
-async def chart(interaction: discord.Interaction, economy, member: discord.Member, days: int):
-    """View stock performance chart for a user with trend line"""
+async def chart(interaction: discord.Interaction, economy, member: discord.Member, days: int, style: str = 'line'):
+    """View stock performance chart for a user with trend line, or as candlesticks"""
     target = member or interaction.user
     
     # Validate days parameter
@@ -207,61 +211,31 @@ async def chart(interaction: discord.Interaction, economy, member: discord.Membe
         await interaction.response.send_message("Please specify a number of days between 1 and 30.", ephemeral=True)
         return
     
-    # Get historical data
-    history = economy.data_handler.get_user_history(target.id, days)
-    
-    if not history:
-        await interaction.response.send_message("No historical data available for this user.", ephemeral=True)
-        return
-    
-    # Extract data for plotting
-    dates = [datetime.fromisoformat(record['recorded_at']) for record in history]
-    values = [record['stock_value'] for record in history]
-    
-    # Create the plot
-    plt.figure(figsize=(12, 7))
-    
-    # Plot actual values
-    plt.plot(dates, values, marker='o', linestyle='-', linewidth=2, markersize=4, label='Actual Price')
-    
-    # Add trend line (linear regression)
-    if len(values) > 1:
-        x = np.arange(len(values))
-        z = np.polyfit(x, values, 1)
-        p = np.poly1d(z)
-        plt.plot(dates, p(x), "r--", alpha=0.7, linewidth=1.5, label='Trend Line')
-    
-    # Format the plot
-    plt.title(f"{target.display_name}'s Stock Performance (Last {days} Days)")
-    plt.xlabel("Date")
-    plt.ylabel("Stock Value ($)")
-    plt.grid(True, alpha=0.3)
-    plt.legend()
-    
-    # Format x-axis to show dates nicely
-    plt.gcf().autofmt_xdate()
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
-    plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=max(1, days//7)))
-    
-    # Add value labels to some points
-    if len(values) > 5:
-        indices_to_label = [0, len(values)-1]
-        indices_to_label.append(values.index(max(values)))
-        indices_to_label.append(values.index(min(values)))
+    # Get historical data, rendering off the event loop and deferring the
+    # response if the chart isn't cached
+    await economy.load_price_history([target.id])
+    if style == 'candle':
+        candles, resolution = economy.get_candles(target.id, days)
+        if not candles:
+            await interaction.response.send_message("No historical data available for this user.", ephemeral=True)
+            return
+        
+        key = ('candle', target.id, days, candles[-1]['start'], candles[-1]['volume'], candles[-1]['close'])
+        if chart_renderer.get_cached(key) is None:
+            await interaction.response.defer()
+        png = await chart_renderer.render(key, render_candle_chart, target.display_name, days, resolution, candles)
+    else:
+        timestamps, prices = economy.get_price_window(target.id, days)
+        if not len(timestamps):
+            await interaction.response.send_message("No historical data available for this user.", ephemeral=True)
+            return
         
-        for i in set(indices_to_label):
-            if i < len(values):
-                plt.annotate(f"${values[i]:.2f}", 
-                            (dates[i], values[i]),
-                            textcoords="offset points",
-                            xytext=(0,10),
-                            ha='center')
-    
-    # Save to bytes buffer
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
+        timestamps = timestamps.tolist()
+        values = prices.tolist()
+        key = ('line', target.id, days, timestamps[-1], len(timestamps))
+        if chart_renderer.get_cached(key) is None:
+            await interaction.response.defer()
+        png = await chart_renderer.render(key, render_stock_chart, target.display_name, days, timestamps, values)
     
     # Get current stock value for context
     current_value = economy.get_stock_price(target.id)
@@ -276,9 +250,9 @@ async def chart(interaction: discord.Interaction, economy, member: discord.Membe
     )
     
     # Send the chart as a file
-    file = discord.File(buf, filename="stock_chart.png")
+    file = discord.File(io.BytesIO(png), filename="stock_chart.png")
     embed.set_image(url="attachment://stock_chart.png")
-    await interaction.response.send_message(embed=embed, file=file)
+    await send_response(interaction, embed=embed, file=file)
 
 
 # Company commands (new)
@@ -310,7 +284,7 @@ async def hire_employee(interaction: discord.Interaction, economy, user: discord
         return
         
     # Get user's company
-    employee_data = economy.data_handler.get_employee(interaction.user.id)
+    employee_data = economy.get_employee(interaction.user.id)
     if not employee_data or not employee_data.get('company_id'):
         await interaction.response.send_message("You are not part of a company", ephemeral=True)
         return
@@ -335,7 +309,7 @@ async def hire_employee(interaction: discord.Interaction, economy, user: discord
 async def fire_employee(interaction: discord.Interaction, economy, user: discord.Member):
     """Fire an employee from your company"""
     # Get user's company
-    employee_data = economy.data_handler.get_employee(interaction.user.id)
+    employee_data = economy.get_employee(interaction.user.id)
     if not employee_data or not employee_data.get('company_id'):
         await interaction.response.send_message("You are not part of a company", ephemeral=True)
         return
@@ -364,7 +338,7 @@ async def create_task(interaction: discord.Interaction, economy, title: str, des
         return
         
     # Get user's company
-    employee_data = economy.data_handler.get_employee(interaction.user.id)
+    employee_data = economy.get_employee(interaction.user.id)
     if not employee_data or not employee_data.get('company_id'):
         await interaction.response.send_message("You are not part of a company", ephemeral=True)
         return
@@ -389,7 +363,7 @@ async def create_task(interaction: discord.Interaction, economy, title: str, des
 async def complete_task(interaction: discord.Interaction, economy, task_id: int):
     """Complete a task and receive reward"""
     # Get user's company
-    employee_data = economy.data_handler.get_employee(interaction.user.id)
+    employee_data = economy.get_employee(interaction.user.id)
     if not employee_data or not employee_data.get('company_id'):
         await interaction.response.send_message("You are not part of a company", ephemeral=True)
         return
@@ -418,7 +392,7 @@ async def create_deal(interaction: discord.Interaction, economy, target_company:
         return
         
     # Get user's company
-    employee_data = economy.data_handler.get_employee(interaction.user.id)
+    employee_data = economy.get_employee(interaction.user.id)
     if not employee_data or not employee_data.get('company_id'):
         await interaction.response.send_message("You are not part of a company", ephemeral=True)
         return
@@ -452,7 +426,7 @@ async def create_deal(interaction: discord.Interaction, economy, target_company:
 async def accept_deal(interaction: discord.Interaction, economy, deal_id: int):
     """Accept a proposed deal"""
     # Get user's company
-    employee_data = economy.data_handler.get_employee(interaction.user.id)
+    employee_data = economy.get_employee(interaction.user.id)
     if not employee_data or not employee_data.get('company_id'):
         await interaction.response.send_message("You are not part of a company", ephemeral=True)
         return
@@ -478,7 +452,7 @@ async def company_info(interaction: discord.Interaction, economy, company_id: in
     """View information about a company"""
     # If no company ID provided, try to get user's company
     if company_id is None:
-        employee_data = economy.data_handler.get_employee(interaction.user.id)
+        employee_data = economy.get_employee(interaction.user.id)
         if not employee_data or not employee_data.get('company_id'):
             await interaction.response.send_message("You are not part of a company and no company ID was provided", ephemeral=True)
             return
@@ -524,3 +498,42 @@ async def company_info(interaction: discord.Interaction, economy, company_id: in
         embed.add_field(name="Active Tasks", value=tasks_text, inline=False)
     
     await interaction.response.send_message(embed=embed)
+
+async def payroll_preview(interaction: discord.Interaction, economy):
+    """Preview your company's next payroll run without paying anyone"""
+    employee_data = economy.get_employee(interaction.user.id)
+    if not employee_data or not employee_data.get('company_id'):
+        await interaction.response.send_message("You are not part of a company", ephemeral=True)
+        return
+    
+    company_id = employee_data['company_id']
+    company_info = economy.get_company_info(company_id)
+    if not company_info:
+        await interaction.response.send_message("Company not found", ephemeral=True)
+        return
+    
+    plan = economy.preview_payroll(company_id)
+    funds = company_info.get('funds', 0)
+    embed = discord.Embed(
+        title=f"{company_info.get('name', 'Unknown Company')} Payroll Preview",
+        description="What the next payroll run would pay, based on current funds",
+        color=discord.Color.blue() if not plan['skipped'] else discord.Color.orange()
+    )
+    embed.add_field(name="Funds", value=f"${funds:,.2f}", inline=True)
+    embed.add_field(name="Payroll", value=f"${plan['total']:,.2f}", inline=True)
+    embed.add_field(name="Funds After", value=f"${funds - plan['total']:,.2f}", inline=True)
+    embed.add_field(name="Paid", value=str(len(plan['payments'])), inline=True)
+    embed.add_field(name="Unpaid", value=str(len(plan['skipped'])), inline=True)
+    next_payroll = economy.get_next_payroll_time(company_id)
+    if next_payroll:
+        embed.add_field(name="Next Payroll", value=f"<t:{int(next_payroll)}:R>", inline=True)
+    
+    if plan['skipped']:
+        skipped_text = ""
+        for user_id, _, salary in plan['skipped'][:10]:  # Show up to 10 employees
+            skipped_text += f"<@{user_id}> (${salary:,.2f})\n"
+        if len(plan['skipped']) > 10:
+            skipped_text += f"... and {len(plan['skipped']) - 10} more"
+        embed.add_field(name="Not Enough Funds For", value=skipped_text, inline=False)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
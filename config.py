@@ -28,6 +28,7 @@ MIN_MESSAGE_LENGTH = 5
 # Company configuration
 COMPANY_CREATION_COST = 5000
 EMPLOYEE_SALARY_INTERVAL = 86400  # Daily salary payments
+PAYROLL_MAX_CATCHUP_CYCLES = 7  # Missed payroll cycles paid after downtime, older ones are dropped
 COMPANY_DEAL_COOLDOWN = 3600  # 1 hour between deals
 TASK_COMPLETION_REWARD = 50  # Base reward for completing tasks
 
@@ -44,15 +45,66 @@ DATA_DIR = 'data'
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 INVESTMENTS_FILE = os.path.join(DATA_DIR, 'investments.json')
 TRANSACTIONS_FILE = os.path.join(DATA_DIR, 'transactions.json')
-HISTORY_FILE = os.path.join(DATA_DIR, 'history.json')
+HISTORY_FILE = os.path.join(DATA_DIR, 'history.json')  # Only read to migrate to HISTORY_DIR
+HISTORY_DIR = os.path.join(DATA_DIR, 'history')  # One history segment per day
 SPAM_TRACKER_FILE = os.path.join(DATA_DIR, 'spam_tracker.json')
 COMPANIES_FILE = os.path.join(DATA_DIR, 'companies.json')
 EMPLOYEES_FILE = os.path.join(DATA_DIR, 'employees.json')
 TASKS_FILE = os.path.join(DATA_DIR, 'tasks.json')
 DEALS_FILE = os.path.join(DATA_DIR, 'deals.json')
+COUNTERS_FILE = os.path.join(DATA_DIR, 'counters.json')
+CANDLES_FILE = os.path.join(DATA_DIR, 'candles.json')
+
+# Storage engine: 'json' keeps each collection in files under DATA_DIR,
+# 'sqlite' keeps everything in DATABASE_PATH (imported from the JSON files
+# the first time it starts)
+STORAGE_BACKEND = 'json'
+DATABASE_PATH = os.path.join(DATA_DIR, 'economy.db')
+DATABASE_BUSY_TIMEOUT = 5.0  # Seconds a worker thread waits on a locked database
+DATABASE_STATEMENT_CACHE = 256  # Prepared statements kept per connection
+
+# Storage mode of the json backend: 'log' appends each write to a
+# line-delimited log and periodically compacts it into the JSON snapshot,
+# 'json' re-reads and rewrites the whole file on every write, so its syncs
+# slow down as the collections grow
+STORAGE_MODE = 'log'
+LOG_COMPACT_THRESHOLD = 5000  # Logged writes per collection before compaction
+# Snapshot encoding: 'json' (indented, readable) or 'binary' (compact columnar).
+# Snapshots in the other format are converted on startup, see migrate.py.
+SNAPSHOT_FORMAT = 'json'
+# When writes are forced to disk: 'none' (left to the OS), 'batch' (writes
+# within DURABILITY_BATCH_WINDOW seconds share one fsync) or 'always'
+DURABILITY = 'batch'
+DURABILITY_BATCH_WINDOW = 0.05
 
 # Chart configuration
 CHART_DAYS_LIMIT = 30
+CHART_RENDER_WORKERS = 2  # Processes rendering charts off the event loop
+CHART_CACHE_SIZE = 128  # Rendered chart PNGs kept in memory
+CHART_MAX_POINTS = 600  # Points plotted per chart, longer histories are downsampled
+CHART_HOURLY_CANDLE_DAYS = 7  # Longer candlestick charts use daily candles
+
+# History retention: raw points are rolled up into hourly and daily candles,
+# daily candles are kept forever
+HISTORY_RAW_RETENTION = 48 * 3600
+CANDLE_HOURLY_RETENTION = 30 * 86400
+HISTORY_RETENTION_INTERVAL = 3600  # Seconds between retention passes
+# How price history is loaded at startup: 'eager' before the bot starts,
+# 'background' in a thread after users and companies are loaded, or 'lazy'
+# one user at a time, the first time their history is used
+HISTORY_LOAD_MODE = 'background'
+
+# Activity pipeline configuration
+ACTIVITY_WORKERS = 4  # Number of shards, each with its own queue and worker
+ACTIVITY_QUEUE_MAXSIZE = 1000  # Maximum queued events per shard
+ACTIVITY_OVERFLOW_POLICY = 'coalesce'  # 'drop' or 'coalesce' when a shard is full
+ACTIVITY_TICK = 1.0  # Seconds to fold a user's messages into one update (0 disables)
+
+# User name resolution configuration
+USER_CACHE_SIZE = 10000  # Display names kept in the LRU cache
+USER_CACHE_TTL = 3600  # Seconds before a cached display name is refetched
+USER_FETCH_CONCURRENCY = 25  # Maximum concurrent fetch_user calls
+USER_FETCH_DEFER_THRESHOLD = 5  # Defer the response when more users need fetching
 
 # Cache configuration
 CACHE_SYNC_INTERVAL = 300
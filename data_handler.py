@@ -1,11 +1,21 @@
+import copy
 import json
 import os
 import time
 import threading
 from datetime import datetime
 import config
+import serialization
+from durability import DurableFiles
+from history_segments import HistorySegmentStore
+from storage import StorageBackend
 
-class JSONDataHandler:
+
+class CorruptSnapshotError(Exception):
+    """A snapshot file exists but can't be decoded"""
+
+
+class JSONDataHandler(StorageBackend):
     def __init__(self):
         self.data_dir = config.DATA_DIR
         # Existing files
@@ -20,64 +30,113 @@ class JSONDataHandler:
         self.employees_file = config.EMPLOYEES_FILE
         self.tasks_file = config.TASKS_FILE
         self.deals_file = config.DEALS_FILE
+        self.counters_file = config.COUNTERS_FILE
+        self.candles_file = config.CANDLES_FILE
         
+        # Also guards self.history, which has no lock of its own
         self.lock = threading.RLock()
         
+        # Snapshot encoding, either 'json' or 'binary'
+        self.snapshot_format = config.SNAPSHOT_FORMAT
+        self.serializer = serialization.get_serializer(self.snapshot_format)
+        
+        # Append-only log state (only used when STORAGE_MODE is 'log')
+        self.storage_mode = config.STORAGE_MODE
+        self.log_compact_threshold = config.LOG_COMPACT_THRESHOLD
+        self._resident = {}
+        self._log_handles = {}
+        self._log_counts = {}
+        self._next_ids = {}
+        
+        # Atomic writes, fsynced according to DURABILITY
+        self.files = DurableFiles(config.DURABILITY, config.DURABILITY_BATCH_WINDOW)
+        
         # Initialize data directory
         os.makedirs(self.data_dir, exist_ok=True)
+        if DurableFiles.remove_stale_temp_files(self.data_dir):
+            print("Removed temp files left by an interrupted write")
         
-        # Initialize data files if they don't exist
+        # Initialize data files if they don't exist, converting any snapshots
+        # left in the other format
+        for file_path in self._snapshot_files():
+            if serialization.convert_snapshot(file_path, self.snapshot_format):
+                print(f"Converted {os.path.basename(file_path)} to the {self.snapshot_format} snapshot format")
         self._init_data_files()
+        self._load_counters()
+        
+        # History is partitioned into day segments rather than kept in one file
+        self.history = HistorySegmentStore(config.HISTORY_DIR, self.files)
+        self._migrate_history()
+        
+        if self.storage_mode == 'log':
+            self._replay_logs()
     
     def _init_data_files(self):
         """Initialize data files with empty structures if they don't exist"""
         with self.lock:
             # Existing files
-            if not os.path.exists(self.users_file):
+            if not os.path.exists(self._snapshot_path(self.users_file)):
                 self._save_data({}, self.users_file)
             
-            if not os.path.exists(self.investments_file):
+            if not os.path.exists(self._snapshot_path(self.investments_file)):
                 self._save_data([], self.investments_file)
             
-            if not os.path.exists(self.transactions_file):
+            if not os.path.exists(self._snapshot_path(self.transactions_file)):
                 self._save_data([], self.transactions_file)
             
-            if not os.path.exists(self.history_file):
-                self._save_data([], self.history_file)
+            if not os.path.exists(self._snapshot_path(self.candles_file)):
+                self._save_data({}, self.candles_file)
             
-            if not os.path.exists(self.spam_tracker_file):
+            if not os.path.exists(self._snapshot_path(self.spam_tracker_file)):
                 self._save_data({}, self.spam_tracker_file)
             
             # New company system files
-            if not os.path.exists(self.companies_file):
+            if not os.path.exists(self._snapshot_path(self.companies_file)):
                 self._save_data({}, self.companies_file)
             
-            if not os.path.exists(self.employees_file):
+            if not os.path.exists(self._snapshot_path(self.employees_file)):
                 self._save_data({}, self.employees_file)
             
-            if not os.path.exists(self.tasks_file):
+            if not os.path.exists(self._snapshot_path(self.tasks_file)):
                 self._save_data({}, self.tasks_file)
             
-            if not os.path.exists(self.deals_file):
+            if not os.path.exists(self._snapshot_path(self.deals_file)):
                 self._save_data({}, self.deals_file)
     
-    def _load_data(self, file_path):
-        """Load data from a JSON file"""
+    def _is_dict_collection(self, file_path):
+        return file_path in [self.users_file, self.companies_file, self.employees_file,
+                             self.tasks_file, self.deals_file, self.spam_tracker_file, self.candles_file]
+    
+    def _snapshot_files(self):
+        return [self.users_file, self.investments_file, self.transactions_file, self.spam_tracker_file,
+                self.companies_file, self.employees_file, self.tasks_file, self.deals_file,
+                self.counters_file, self.candles_file]
+    
+    def _snapshot_path(self, file_path, format_name=None):
+        """Path of a collection's snapshot in the configured (or given) format"""
+        return serialization.snapshot_path(file_path, format_name or self.snapshot_format)
+    
+    def _load_data(self, file_path, format_name=None):
+        """Load data from a collection's snapshot file"""
+        snapshot_path = self._snapshot_path(file_path, format_name)
         try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            with open(snapshot_path, 'rb') as f:
+                return serialization.get_serializer(format_name or self.snapshot_format).loads(f.read())
+        except FileNotFoundError:
             # Return appropriate empty data structure based on file
-            if file_path in [self.users_file, self.companies_file, self.employees_file, 
-                           self.tasks_file, self.deals_file, self.spam_tracker_file]:
+            if self._is_dict_collection(file_path):
                 return {}
             return []
+        except ValueError as e:
+            # Treating it as empty would overwrite the collection on the next write
+            raise CorruptSnapshotError(f"{snapshot_path} is corrupt ({e}), restore it from a backup "
+                                       f"or remove it to start the collection empty")
     
     def _save_data(self, data, file_path):
-        """Save data to a JSON file with pretty formatting"""
+        """Save data to a collection's snapshot file"""
         try:
-            with open(file_path, 'w') as f:
-                json.dump(data, f, indent=2, default=self._json_serializer)
+            encoded = self.serializer.dumps(data, default=self._json_serializer)
+            self.files.write_atomic(self._snapshot_path(file_path), encoded)
             return True
         except Exception as e:
             print(f"Error saving data to {file_path}: {e}")
@@ -89,180 +148,459 @@ class JSONDataHandler:
             return obj.isoformat()
         raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
     
+    # Append-only log storage
+    #
+    # In 'log' mode every collection is kept resident in memory and each write
+    # is appended to <collection>.log as one JSON op per line. The regular JSON
+    # file becomes a snapshot that the log is replayed over on startup, and is
+    # rewritten (compacted) once the log reaches LOG_COMPACT_THRESHOLD ops.
+    # List collections (investments, transactions) are held as dicts
+    # keyed by row id so updates and removals don't scan the collection.
+    def _log_path(self, file_path):
+        return os.path.splitext(file_path)[0] + '.log'
+    
+    def _to_resident(self, file_path, data):
+        """Convert on-disk collection data to its resident form"""
+        if self._is_dict_collection(file_path):
+            return data
+        rows = {}
+        next_id = 1
+        for row in data:
+            if row.get('id') is None:
+                row['id'] = next_id
+            rows[row['id']] = row
+            next_id = max(next_id, row['id'] + 1)
+        self._next_ids[file_path] = max(next_id, self._next_ids.get(file_path, 1))
+        return rows
+    
+    def _from_resident(self, file_path, data):
+        """Convert resident collection data to its on-disk form"""
+        if self._is_dict_collection(file_path):
+            return data
+        return list(data.values())
+    
+    def _load_resident(self, file_path, format_name=None):
+        """Load a snapshot and replay its log on top of it. Returns (data, logged op count)."""
+        data = self._to_resident(file_path, self._load_data(file_path, format_name))
+        count = 0
+        log_path = self._log_path(file_path)
+        if os.path.exists(log_path):
+            with open(log_path, 'r+b') as f:
+                replayed = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError("missing newline")
+                        op = serialization.loads(line)
+                    except ValueError:
+                        # A torn entry from a crash mid-append is cut off so
+                        # the next append starts on a fresh line
+                        print(f"Discarding incomplete log entry at byte {replayed} of {log_path}")
+                        f.truncate(replayed)
+                        break
+                    self._apply_resident_op(file_path, data, op)
+                    replayed += len(line)
+                    count += 1
+        return data, count
+    
+    def _replay_logs(self):
+        """Load every snapshot and replay its log on top of it"""
+        with self.lock:
+            for file_path in [self.users_file, self.investments_file, self.transactions_file,
+                              self.spam_tracker_file, self.companies_file, self.employees_file,
+                              self.tasks_file, self.deals_file, self.candles_file]:
+                self._resident[file_path], self._log_counts[file_path] = self._load_resident(file_path)
+    
+    def _apply_resident_op(self, file_path, data, op):
+        """Apply a logged op to resident collection data. Returns False if it was a no-op."""
+        kind = op['op']
+        if kind == 'replace':
+            data.clear()
+            data.update(self._to_resident(file_path, op['value']))
+        elif kind == 'set':
+            data[op['key']] = op['value']
+        elif kind == 'update':
+            if op['key'] not in data:
+                return False
+            data[op['key']].update(op['value'])
+        elif kind == 'delete':
+            if op['key'] not in data:
+                return False
+            del data[op['key']]
+        elif kind in ('append', 'upsert'):
+            row = op['value']
+            data[row['id']] = row
+            self._next_ids[file_path] = max(self._next_ids.get(file_path, 1), row['id'] + 1)
+        return True
+    
+    def _apply_plain_op(self, file_path, data, op):
+        """Apply an op to collection data as loaded from its JSON file"""
+        if self._is_dict_collection(file_path) or op['op'] in ('replace', 'append'):
+            if op['op'] == 'replace':
+                return op['value']
+            if op['op'] == 'append':
+                data.append(op['value'])
+                return data
+            if op['op'] == 'set':
+                data[op['key']] = op['value']
+                return data
+            if op['key'] not in data:
+                return None
+            if op['op'] == 'update':
+                data[op['key']].update(op['value'])
+            else:
+                del data[op['key']]
+            return data
+        
+        # Row-level ops on list collections are keyed by row id
+        key = op['value']['id'] if op['op'] == 'upsert' else op['key']
+        for index, row in enumerate(data):
+            if row.get('id') == key:
+                if op['op'] == 'upsert':
+                    data[index] = op['value']
+                elif op['op'] == 'update':
+                    row.update(op['value'])
+                else:
+                    del data[index]
+                return data
+        if op['op'] == 'upsert':
+            data.append(op['value'])
+            return data
+        return None
+    
+    def _write(self, file_path, op):
+        """Apply a single write op to a collection using the configured storage mode"""
+        with self.lock:
+            if self.storage_mode != 'log':
+                data = self._load_data(file_path)
+                self._assign_ids(file_path, [op], data)
+                data = self._apply_plain_op(file_path, data, op)
+                if data is None:
+                    return False
+                return self._save_data(data, file_path)
+            
+            self._assign_ids(file_path, [op])
+            data = self._resident[file_path]
+            if not self._apply_resident_op(file_path, data, op):
+                return False
+            
+            # Whole-collection writes are cheaper as a snapshot than as a log entry
+            if op['op'] == 'replace':
+                return self._compact(file_path)
+            
+            return self._append_log(file_path, op)
+    
+    def _write_many(self, file_path, ops):
+        """Apply several write ops to a collection with a single file write"""
+        with self.lock:
+            if self.storage_mode != 'log':
+                data = self._load_data(file_path)
+                self._assign_ids(file_path, ops, data)
+                for op in ops:
+                    data = self._apply_plain_op(file_path, data, op) or data
+                return self._save_data(data, file_path)
+            
+            self._assign_ids(file_path, ops)
+            data = self._resident[file_path]
+            ops = [op for op in ops if self._apply_resident_op(file_path, data, op)]
+            return self._append_log(file_path, *ops)
+    
+    # Row id counters
+    #
+    # New rows in list collections take their ids from counters persisted in
+    # counters.json, so assigning an id never needs a scan of the collection.
+    def _load_counters(self):
+        with self.lock:
+            counters = self._load_data(self.counters_file) or {}
+            for file_path in [self.investments_file, self.transactions_file]:
+                if self._counter_name(file_path) in counters:
+                    self._next_ids[file_path] = counters[self._counter_name(file_path)]
+    
+    def _counter_name(self, file_path):
+        return os.path.splitext(os.path.basename(file_path))[0]
+    
+    def _reserve_ids(self, file_path, count, data=None):
+        """Reserve a block of row ids and return the first one"""
+        with self.lock:
+            if file_path not in self._next_ids:
+                # No persisted counter yet, seed it from the current rows
+                rows = self._load_data(file_path) if data is None else data
+                self._next_ids[file_path] = max([row.get('id', 0) for row in rows] + [0]) + 1
+            
+            first_id = self._next_ids[file_path]
+            self._next_ids[file_path] = first_id + count
+            
+            # Persist the counter before the rows so ids are never handed out twice
+            counters = {self._counter_name(path): next_id for path, next_id in self._next_ids.items()}
+            self._save_data(counters, self.counters_file)
+            return first_id
+    
+    def _assign_ids(self, file_path, ops, data=None):
+        """Give rows appended by ops the next free ids"""
+        new_rows = [op['value'] for op in ops if op['op'] == 'append' and 'id' not in op['value']]
+        if not new_rows:
+            return
+        next_id = self._reserve_ids(file_path, len(new_rows), data)
+        for row in new_rows:
+            row['id'] = next_id
+            next_id += 1
+    
+    def _append_log(self, file_path, *ops):
+        if not ops:
+            return True
+        try:
+            handle = self._log_handles.get(file_path)
+            if handle is None:
+                handle = open(self._log_path(file_path), 'a')
+                self._log_handles[file_path] = handle
+            handle.write(''.join(json.dumps(op, separators=(',', ':'), default=self._json_serializer) + '\n'
+                                 for op in ops))
+            self.files.append(handle)
+        except Exception as e:
+            print(f"Error appending to log for {file_path}: {e}")
+            return False
+        
+        self._log_counts[file_path] = self._log_counts.get(file_path, 0) + len(ops)
+        if self._log_counts[file_path] >= self.log_compact_threshold:
+            self._compact(file_path)
+        return True
+    
+    def _compact(self, file_path):
+        """Write the resident collection as a snapshot and truncate its log"""
+        with self.lock:
+            if not self._save_data(self._from_resident(file_path, self._resident[file_path]), file_path):
+                return False
+            
+            # Replaying ops that are already in the snapshot is harmless, so a
+            # crash between the snapshot and the truncate can't corrupt state
+            handle = self._log_handles.pop(file_path, None)
+            if handle is not None:
+                handle.close()
+            open(self._log_path(file_path), 'w').close()
+            self._log_counts[file_path] = 0
+            return True
+    
+    def compact(self):
+        """Compact every collection log into its snapshot"""
+        if self.storage_mode != 'log':
+            return
+        with self.lock:
+            for file_path in list(self._resident):
+                if self._log_counts.get(file_path):
+                    self._compact(file_path)
+    
+    def commit_writes(self):
+        """Fsync every write still waiting for its batch window. Returns the seconds spent."""
+        return self.files.commit()
+    
+    def _read(self, file_path):
+        """Read a copy of a whole collection in its on-disk form"""
+        with self.lock:
+            if self.storage_mode != 'log':
+                return self._load_data(file_path)
+            # Callers get their own copy, so the resident data only ever
+            # changes here under self.lock, e.g. while it's being compacted
+            data = copy.deepcopy(self._resident[file_path])
+            if self._is_dict_collection(file_path):
+                return data
+            return list(data.values())
+    
+    def _read_item(self, file_path, key, default=None):
+        """Read a copy of a single entry from a dict collection"""
+        with self.lock:
+            if self.storage_mode != 'log':
+                return self._load_data(file_path).get(key, default)
+            return copy.deepcopy(self._resident[file_path].get(key, default))
+    
     # User operations (existing)
     def get_all_users(self):
-        with self.lock:
-            return self._load_data(self.users_file)
+        return self._read(self.users_file)
     
     def get_user(self, user_id):
-        users = self.get_all_users()
-        return users.get(str(user_id))
+        return self._read_item(self.users_file, str(user_id))
     
     def save_user(self, user_data):
-        with self.lock:
-            users = self.get_all_users()
-            users[str(user_data['user_id'])] = user_data
-            return self._save_data(users, self.users_file)
+        return self._write(self.users_file, {'op': 'set', 'key': str(user_data['user_id']), 'value': user_data})
     
     def save_all_users(self, users_data):
-        with self.lock:
-            return self._save_data(users_data, self.users_file)
+        return self._write(self.users_file, {'op': 'replace', 'value': users_data})
+    
+    def save_users(self, users_data):
+        """Save several users with a single write"""
+        return self._write_many(self.users_file, [{'op': 'set', 'key': user_id, 'value': user_data}
+                                                  for user_id, user_data in users_data.items()])
     
     # Investment operations (existing)
     def get_all_investments(self):
-        with self.lock:
-            return self._load_data(self.investments_file)
+        return self._read(self.investments_file)
     
     def save_investment(self, investment_data):
-        with self.lock:
-            investments = self.get_all_investments()
-            if 'id' not in investment_data:
-                investment_data['id'] = max([inv.get('id', 0) for inv in investments] + [0]) + 1
-            investments.append(investment_data)
-            return self._save_data(investments, self.investments_file)
+        return self._write(self.investments_file, {'op': 'append', 'value': investment_data})
     
     def update_investment(self, investment_id, updates):
-        with self.lock:
-            investments = self.get_all_investments()
-            for investment in investments:
-                if investment.get('id') == investment_id:
-                    investment.update(updates)
-                    return self._save_data(investments, self.investments_file)
-            return False
+        return self._write(self.investments_file, {'op': 'update', 'key': investment_id, 'value': updates})
     
     def remove_investment(self, investment_id):
-        with self.lock:
-            investments = self.get_all_investments()
-            investments = [inv for inv in investments if inv.get('id') != investment_id]
-            return self._save_data(investments, self.investments_file)
+        # Removing an unknown investment is not an error
+        self._write(self.investments_file, {'op': 'delete', 'key': investment_id})
+        return True
+    
+    def save_investment_changes(self, changed, removed_ids):
+        """Write back changed investment rows and delete removed ones in one write"""
+        ops = [{'op': 'upsert', 'value': investment} for investment in changed]
+        ops += [{'op': 'delete', 'key': investment_id} for investment_id in removed_ids]
+        return self._write_many(self.investments_file, ops)
     
     # Transaction operations (existing)
     def get_all_transactions(self):
-        with self.lock:
-            return self._load_data(self.transactions_file)
+        return self._read(self.transactions_file)
     
     def save_transaction(self, transaction_data):
-        with self.lock:
-            transactions = self.get_all_transactions()
-            if 'id' not in transaction_data:
-                transaction_data['id'] = max([t.get('id', 0) for t in transactions] + [0]) + 1
-            transaction_data['created_at'] = datetime.now().isoformat()
-            transactions.append(transaction_data)
-            return self._save_data(transactions, self.transactions_file)
+        transaction_data['created_at'] = datetime.now().isoformat()
+        return self._write(self.transactions_file, {'op': 'append', 'value': transaction_data})
     
-    # History operations (existing)
-    def get_all_history(self):
-        with self.lock:
-            return self._load_data(self.history_file)
+    def save_transaction_batch(self, transactions):
+        """Record several transactions with a single write"""
+        created_at = datetime.now().isoformat()
+        for transaction_data in transactions:
+            transaction_data['created_at'] = created_at
+        return self._write_many(self.transactions_file, [{'op': 'append', 'value': transaction_data}
+                                                         for transaction_data in transactions])
     
-    def save_history(self, history_data):
+    # History operations (existing)
+    def _migrate_history(self):
+        """Move records from the old single history file into day segments"""
         with self.lock:
-            history = self.get_all_history()
-            if 'id' not in history_data:
-                history_data['id'] = max([h.get('id', 0) for h in history] + [0]) + 1
-            history_data['recorded_at'] = datetime.now().isoformat()
-            history.append(history_data)
-            return self._save_data(history, self.history_file)
-    
-    def get_user_history(self, user_id, days=7):
-        history = self.get_all_history()
-        cutoff = time.time() - (days * 24 * 3600)
-        
-        return [record for record in history 
-                if record.get('user_id') == user_id and 
-                self._parse_timestamp(record.get('recorded_at', 0)) > cutoff]
+            if not os.path.exists(self._snapshot_path(self.history_file, 'json')):
+                return
+            
+            # The single history file was only ever written as JSON
+            records = list(self._load_resident(self.history_file, 'json')[0].values())
+            for record in records:
+                record.pop('id', None)
+                if not isinstance(record.get('recorded_at'), str):
+                    record['recorded_at'] = datetime.fromtimestamp(self._parse_timestamp(record.get('recorded_at', 0))).isoformat()
+            self.history.append(records)
+            
+            # Keep the old file around rather than deleting it
+            os.replace(self.history_file, self.history_file + '.migrated')
+            if os.path.exists(self._log_path(self.history_file)):
+                os.remove(self._log_path(self.history_file))
+            print(f"Migrated {len(records)} history records into {len(self.history.segments)} day segments")
+    
+    def get_history_rows(self, start=None, end=None, user_id=None):
+        """Get history as a packed NumPy array of HistorySegmentStore.RECORD_DTYPE rows"""
+        with self.lock:
+            return self.history.read_rows(start, end, user_id)
+    
+    def save_history_batch(self, history_records):
+        """Save several history records with a single append per day segment"""
+        recorded_at = datetime.now().isoformat()
+        for history_data in history_records:
+            history_data.setdefault('recorded_at', recorded_at)
+        with self.lock:
+            try:
+                self.history.append(history_records)
+                self.history.seal_finished(time.time())
+                return True
+            except Exception as e:
+                print(f"Error saving history: {e}")
+                return False
+    
+    def prune_history(self, cutoff):
+        """Prune the day segments"""
+        with self.lock:
+            try:
+                return self.history.prune(cutoff)
+            except Exception as e:
+                print(f"Error pruning history: {e}")
+                return 0
+    
+    # Candle operations
+    def get_all_candles(self):
+        return self._read(self.candles_file)
+    
+    def save_candles(self, candles):
+        """Save {key: candle} records with a single write"""
+        return self._write_many(self.candles_file, [{'op': 'set', 'key': key, 'value': candle}
+                                                    for key, candle in candles.items()])
+    
+    def remove_candles(self, keys):
+        """Remove candles by key with a single write"""
+        return self._write_many(self.candles_file, [{'op': 'delete', 'key': key} for key in keys])
     
     # Spam tracker operations (existing)
     def get_spam_data(self):
-        with self.lock:
-            return self._load_data(self.spam_tracker_file)
+        return self._read(self.spam_tracker_file)
     
     def save_spam_data(self, spam_data):
-        with self.lock:
-            return self._save_data(spam_data, self.spam_tracker_file)
+        return self._write(self.spam_tracker_file, {'op': 'replace', 'value': spam_data})
     
     def update_user_spam_data(self, user_id, spam_data):
-        with self.lock:
-            all_spam_data = self.get_spam_data()
-            all_spam_data[str(user_id)] = spam_data
-            return self.save_spam_data(all_spam_data)
+        return self._write(self.spam_tracker_file, {'op': 'set', 'key': str(user_id), 'value': spam_data})
+    
+    def update_spam_data_batch(self, spam_updates):
+        """Save spam data for several users with a single write"""
+        return self._write_many(self.spam_tracker_file, [{'op': 'set', 'key': str(user_id), 'value': spam_data}
+                                                         for user_id, spam_data in spam_updates.items()])
     
     # Company operations (new)
     def get_all_companies(self):
-        with self.lock:
-            return self._load_data(self.companies_file)
+        return self._read(self.companies_file)
     
     def get_company(self, company_id):
-        companies = self.get_all_companies()
-        return companies.get(str(company_id))
+        return self._read_item(self.companies_file, str(company_id))
     
     def save_company(self, company_data):
-        with self.lock:
-            companies = self.get_all_companies()
-            companies[str(company_data['id'])] = company_data
-            return self._save_data(companies, self.companies_file)
+        return self._write(self.companies_file, {'op': 'set', 'key': str(company_data['id']), 'value': company_data})
+    
+    def save_companies(self, companies_data):
+        """Save several companies with a single write"""
+        return self._write_many(self.companies_file, [{'op': 'set', 'key': company_id, 'value': company_data}
+                                                      for company_id, company_data in companies_data.items()])
     
     def update_company(self, company_id, updates):
-        with self.lock:
-            companies = self.get_all_companies()
-            if str(company_id) in companies:
-                companies[str(company_id)].update(updates)
-                return self._save_data(companies, self.companies_file)
-            return False
+        return self._write(self.companies_file, {'op': 'update', 'key': str(company_id), 'value': updates})
     
     def remove_company(self, company_id):
-        with self.lock:
-            companies = self.get_all_companies()
-            if str(company_id) in companies:
-                del companies[str(company_id)]
-                return self._save_data(companies, self.companies_file)
-            return False
+        return self._write(self.companies_file, {'op': 'delete', 'key': str(company_id)})
     
     # Employee operations (new)
     def get_all_employees(self):
-        with self.lock:
-            return self._load_data(self.employees_file)
+        return self._read(self.employees_file)
     
     def get_employee(self, user_id):
-        employees = self.get_all_employees()
-        return employees.get(str(user_id))
+        return self._read_item(self.employees_file, str(user_id))
     
     def save_employee(self, employee_data):
-        with self.lock:
-            employees = self.get_all_employees()
-            employees[str(employee_data['user_id'])] = employee_data
-            return self._save_data(employees, self.employees_file)
+        return self._write(self.employees_file, {'op': 'set', 'key': str(employee_data['user_id']), 'value': employee_data})
     
     def update_employee(self, user_id, updates):
-        with self.lock:
-            employees = self.get_all_employees()
-            if str(user_id) in employees:
-                employees[str(user_id)].update(updates)
-                return self._save_data(employees, self.employees_file)
-            return False
+        return self._write(self.employees_file, {'op': 'update', 'key': str(user_id), 'value': updates})
     
     def remove_employee(self, user_id):
-        with self.lock:
-            employees = self.get_all_employees()
-            if str(user_id) in employees:
-                del employees[str(user_id)]
-                return self._save_data(employees, self.employees_file)
-            return False
+        return self._write(self.employees_file, {'op': 'delete', 'key': str(user_id)})
+    
+    def save_employee_changes(self, changed, removed_ids):
+        """Save changed employees and remove others with a single write"""
+        ops = [{'op': 'set', 'key': user_id, 'value': employee_data} for user_id, employee_data in changed.items()]
+        ops += [{'op': 'delete', 'key': str(user_id)} for user_id in removed_ids]
+        return self._write_many(self.employees_file, ops)
     
     # Task operations (new)
     def get_all_tasks(self):
-        with self.lock:
-            return self._load_data(self.tasks_file)
+        return self._read(self.tasks_file)
     
     def get_company_tasks(self, company_id):
-        tasks = self.get_all_tasks()
-        return tasks.get(str(company_id), [])
+        return list(self._read_item(self.tasks_file, str(company_id), []))
     
     def save_company_tasks(self, company_id, tasks):
-        with self.lock:
-            all_tasks = self.get_all_tasks()
-            all_tasks[str(company_id)] = tasks
-            return self._save_data(all_tasks, self.tasks_file)
+        return self._write(self.tasks_file, {'op': 'set', 'key': str(company_id), 'value': tasks})
+    
+    def save_tasks(self, tasks_data):
+        """Save several companies' tasks with a single write"""
+        return self._write_many(self.tasks_file, [{'op': 'set', 'key': company_id, 'value': tasks}
+                                                  for company_id, tasks in tasks_data.items()])
     
     def add_company_task(self, company_id, task_data):
         with self.lock:
@@ -290,18 +628,18 @@ class JSONDataHandler:
     
     # Deal operations (new)
     def get_all_deals(self):
-        with self.lock:
-            return self._load_data(self.deals_file)
+        return self._read(self.deals_file)
     
     def get_company_deals(self, company_id):
-        deals = self.get_all_deals()
-        return deals.get(str(company_id), [])
+        return list(self._read_item(self.deals_file, str(company_id), []))
     
     def save_company_deals(self, company_id, deals):
-        with self.lock:
-            all_deals = self.get_all_deals()
-            all_deals[str(company_id)] = deals
-            return self._save_data(all_deals, self.deals_file)
+        return self._write(self.deals_file, {'op': 'set', 'key': str(company_id), 'value': deals})
+    
+    def save_deals(self, deals_data):
+        """Save several companies' deals with a single write"""
+        return self._write_many(self.deals_file, [{'op': 'set', 'key': company_id, 'value': deals}
+                                                  for company_id, deals in deals_data.items()])
     
     def add_company_deal(self, company_id, deal_data):
         with self.lock:
@@ -1,151 +1,619 @@
+import asyncio
+import json
+import os
 import sqlite3
-import config
+import threading
 import time
 from contextlib import contextmanager
 from datetime import datetime
+import numpy as np
+import config
+from history_segments import HistorySegmentStore
+from storage import StorageBackend
+
+# PRAGMA synchronous level for each DURABILITY mode. In WAL mode NORMAL only
+# syncs at checkpoints, so recent commits can be lost on power failure but
+# never corrupted, which matches 'batch'.
+SYNCHRONOUS_LEVELS = {'none': 'OFF', 'batch': 'NORMAL', 'always': 'FULL'}
 
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections with timeout"""
-    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30.0)  # Increased timeout
-    conn.row_factory = sqlite3.Row
+SCHEMA = [
+    # Dict collections keep the whole record as JSON next to the columns it is
+    # looked up or filtered by
+    '''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS investments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        investor_id INTEGER,
+        subject_id INTEGER,
+        data TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS investments_investor_index ON investments(investor_id)',
+    'CREATE INDEX IF NOT EXISTS investments_subject_index ON investments(subject_id)',
+    '''CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        type TEXT,
+        created_at TEXT,
+        data TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS transactions_user_index ON transactions(user_id)',
+    # History is stored as plain columns so windows come back as packed rows
+    '''CREATE TABLE IF NOT EXISTS stock_history (
+        user_id INTEGER NOT NULL,
+        recorded_at REAL NOT NULL,
+        stock_value REAL,
+        message_count INTEGER,
+        spam_penalty REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS history_user_time_index ON stock_history(user_id, recorded_at)',
+    'CREATE INDEX IF NOT EXISTS history_time_index ON stock_history(recorded_at)',
+    '''CREATE TABLE IF NOT EXISTS candles (
+        key TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS spam_tracker (
+        user_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS companies (
+        company_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS employees (
+        user_id TEXT PRIMARY KEY,
+        company_id TEXT,
+        data TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS employees_company_index ON employees(company_id)',
+    '''CREATE TABLE IF NOT EXISTS tasks (
+        company_id TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (company_id, id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS deals (
+        company_id TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (company_id, id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )'''
+]
+
+def _on_event_loop():
+    """Whether the calling thread is running an asyncio event loop"""
     try:
-        yield conn
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-        raise
-    finally:
-        conn.close()
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
 
-def init_db():
-    """Initialize database with required tables and WAL mode"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Enable WAL mode for better concurrency
-        cursor.execute('PRAGMA journal_mode=WAL;')
-        cursor.execute('PRAGMA synchronous=NORMAL;')  # Balance between safety and performance
-        
-        # Users table
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                cash_balance REAL DEFAULT {config.INITIAL_BALANCE},
-                message_count INTEGER DEFAULT 0,
-                stock_value REAL DEFAULT {config.INITIAL_STOCK_VALUE},
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Investments table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS investments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                investor_id INTEGER,
-                subject_id INTEGER,
-                shares_owned REAL DEFAULT 0,
-                purchase_price REAL,
-                invested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (investor_id) REFERENCES users (user_id),
-                FOREIGN KEY (subject_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Transactions history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                type TEXT,  -- 'buy', 'sell', 'dividend', etc.
-                amount REAL,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Stock history table for tracking value over time
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS stock_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                stock_value REAL,
-                message_count INTEGER,
-                recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+
+class ConnectionPool:
+    """One long-lived connection per thread, keeping its pragmas and prepared statements"""
+    
+    # A thread running the event loop gets a short busy timeout so a locked
+    # database can't stall it for long
+    EVENT_LOOP_BUSY_TIMEOUT = 0.05  # seconds
+    
+    def __init__(self, database_path, synchronous):
+        self.database_path = database_path
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+    
+    def get(self):
+        """Get the calling thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only ever used by this thread, but close_all runs on another
+            conn = sqlite3.connect(self.database_path, check_same_thread=False,
+                                   cached_statements=config.DATABASE_STATEMENT_CACHE)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f'PRAGMA synchronous={self.synchronous};')
+            self._local.conn = conn
+            self._local.on_event_loop = None
+            with self._lock:
+                self._connections.append(conn)
         
-        # Create index for faster historical queries
-        cursor.execute('CREATE INDEX IF NOT EXISTS history_user_index ON stock_history(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS history_time_index ON stock_history(recorded_at)')
+        # The thread that opened the connection may start or stop running
+        # the event loop later, such as the main thread at startup
+        on_event_loop = _on_event_loop()
+        if self._local.on_event_loop != on_event_loop:
+            timeout = self.EVENT_LOOP_BUSY_TIMEOUT if on_event_loop else config.DATABASE_BUSY_TIMEOUT
+            conn.execute(f'PRAGMA busy_timeout={int(timeout * 1000)};')
+            self._local.on_event_loop = on_event_loop
+        return conn
+    
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+def _json_default(obj):
+    """Custom JSON serializer for non-serializable objects"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+def _dumps(record):
+    return json.dumps(record, separators=(',', ':'), default=_json_default)
+
+def _text(value):
+    """Key column value, stored as text like the JSON backend's keys"""
+    return None if value is None else str(value)
+
+
+class SQLiteDataHandler(StorageBackend):
+    """Storage engine backed by a single SQLite database in WAL mode, one indexed table per collection"""
+    
+    def __init__(self, database_path=None):
+        self.database_path = database_path or config.DATABASE_PATH
+        self.pool = ConnectionPool(self.database_path, SYNCHRONOUS_LEVELS[config.DURABILITY])
+        # Serializes writers so read-modify-write methods are atomic. Reads
+        # don't take it; WAL lets them run alongside a writer.
+        self.lock = threading.RLock()
         
+        directory = os.path.dirname(self.database_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+        self._import_json_once()
+    
+    def _init_db(self):
+        """Initialize database with required tables and WAL mode"""
+        conn = self.pool.get()
+        # Enable WAL mode for better concurrency
+        conn.execute('PRAGMA journal_mode=WAL;')
+        for statement in SCHEMA:
+            conn.execute(statement)
         conn.commit()
-
-def record_stock_history(user_id, stock_value, message_count):
-    """Record a snapshot of user's stock value and message count with retry logic"""
-    max_retries = 3
-    retry_delay = 0.1  # seconds
     
-    for attempt in range(max_retries):
+    def close(self):
+        """Close every pooled connection"""
+        self.pool.close_all()
+    
+    @contextmanager
+    def _transaction(self):
+        """Commit on success, roll back on error"""
+        conn = self.pool.get()
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO stock_history (user_id, stock_value, message_count)
-                    VALUES (?, ?, ?)
-                ''', (user_id, stock_value, message_count))
-                conn.commit()
-                return  # Success
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                print(f"Database locked, retrying in {retry_delay} seconds (attempt {attempt + 1})")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                print(f"Failed to record stock history after {max_retries} attempts: {e}")
-                raise
-
-def get_user_data(user_id):
-    """Get user data from database"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        return cursor.fetchone()
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
-def update_user_data(user_id, **kwargs):
-    """Update user data in database with retry logic"""
-    max_retries = 3
-    retry_delay = 0.1  # seconds
-    
-    for attempt in range(max_retries):
+    def _run(self, description, work):
+        """Run work(conn) in a transaction. Returns its result, or False on failure."""
+        # A locked database is waited on inside SQLite for the connection's
+        # busy timeout rather than retried here. That still holds up the
+        # calling thread, so EconomySystem only writes from its sync, off the
+        # event loop, and merges back whatever failed.
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                set_clause = ', '.join([f"{key} = ?" for key in kwargs.keys()])
-                values = list(kwargs.values())
-                values.append(user_id)
-                cursor.execute(f'UPDATE users SET {set_clause} WHERE user_id = ?', values)
-                conn.commit()
-                return  # Success
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                print(f"Database locked, retrying in {retry_delay} seconds (attempt {attempt + 1})")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                print(f"Failed to update user data after {max_retries} attempts: {e}")
-                raise
+            with self.lock, self._transaction() as conn:
+                result = work(conn)
+        except sqlite3.Error as e:
+            print(f"Failed to {description}: {e}")
+            return False
+        # Work that only executes statements succeeded; anything else
+        # (False for a missing row, a row count) is its result
+        if result is None or isinstance(result, sqlite3.Cursor):
+            return True
+        return result
 
-def get_stock_history(user_id, days=7):
-    """Get stock history for a user over a specified number of days"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT stock_value, recorded_at 
-            FROM stock_history 
-            WHERE user_id = ? AND recorded_at >= datetime('now', ?)
+    def _query(self, sql, parameters=()):
+        return self.pool.get().execute(sql, parameters).fetchall()
+    
+    def _records(self, sql, parameters=()):
+        """Decode the data column of every row a query returns"""
+        return [json.loads(row['data']) for row in self._query(sql, parameters)]
+    
+    def _record(self, sql, parameters=()):
+        rows = self._query(sql, parameters)
+        return json.loads(rows[0]['data']) if rows else None
+    
+    def _keyed(self, sql, parameters=()):
+        """Read (key, data) rows as {str(key): record}"""
+        return {str(row[0]): json.loads(row['data']) for row in self._query(sql, parameters)}
+    
+    # One-shot import from the JSON files
+    def _import_json_once(self):
+        if self._query("SELECT value FROM meta WHERE key = 'imported_json'"):
+            return
+        has_json_data = any(os.path.exists(os.path.splitext(path)[0] + extension)
+                            for path in (config.USERS_FILE, config.COMPANIES_FILE)
+                            for extension in ('.json', '.bin'))
+        if has_json_data:
+            from data_handler import JSONDataHandler
+            self.import_from(JSONDataHandler())
+        else:
+            self._run("record the JSON import", self._mark_imported)
+    
+    @staticmethod
+    def _mark_imported(conn):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_json', ?)", (datetime.now().isoformat(),))
+    
+    def import_from(self, source):
+        """Replace every collection in this database with the contents of another storage backend"""
+        started = time.perf_counter()
+        users = source.get_all_users()
+        investments = source.get_all_investments()
+        transactions = source.get_all_transactions()
+        history = source.get_history_rows()
+        candles = source.get_all_candles()
+        spam_data = source.get_spam_data()
+        companies = source.get_all_companies()
+        employees = source.get_all_employees()
+        tasks = source.get_all_tasks()
+        deals = source.get_all_deals()
+        
+        def work(conn):
+            for table in ('users', 'investments', 'transactions', 'stock_history', 'candles', 'spam_tracker',
+                          'companies', 'employees', 'tasks', 'deals'):
+                conn.execute(f'DELETE FROM {table}')
+            conn.executemany('INSERT INTO users (user_id, data) VALUES (?, ?)',
+                             [(int(user_id), _dumps(user)) for user_id, user in users.items()])
+            conn.executemany('INSERT INTO investments (id, investor_id, subject_id, data) VALUES (?, ?, ?, ?)',
+                             [self._investment_row(investment) for investment in investments])
+            conn.executemany('INSERT INTO transactions (id, user_id, type, created_at, data) VALUES (?, ?, ?, ?, ?)',
+                             [self._transaction_row(transaction) for transaction in transactions])
+            conn.executemany('INSERT INTO stock_history (user_id, recorded_at, stock_value, message_count, spam_penalty) '
+                             'VALUES (?, ?, ?, ?, ?)', history.tolist())
+            conn.executemany('INSERT INTO candles (key, data) VALUES (?, ?)',
+                             [(key, _dumps(candle)) for key, candle in candles.items()])
+            conn.executemany('INSERT INTO spam_tracker (user_id, data) VALUES (?, ?)',
+                             [(str(user_id), _dumps(data)) for user_id, data in spam_data.items()])
+            conn.executemany('INSERT INTO companies (company_id, data) VALUES (?, ?)',
+                             [(str(company['id']), _dumps(company)) for company in companies.values()])
+            conn.executemany('INSERT INTO employees (user_id, company_id, data) VALUES (?, ?, ?)',
+                             [(str(employee['user_id']), _text(employee.get('company_id')), _dumps(employee))
+                              for employee in employees.values()])
+            for table, items_by_company in (('tasks', tasks), ('deals', deals)):
+                conn.executemany(f'INSERT INTO {table} (company_id, id, data) VALUES (?, ?, ?)',
+                                 [(str(company_id), item.get('id'), _dumps(item))
+                                  for company_id, items in items_by_company.items() for item in items])
+            # Recorded in the same transaction, so an import that stops
+            # partway leaves nothing behind and runs again on the next start
+            self._mark_imported(conn)
+        
+        if not self._run("import data", work):
+            raise RuntimeError(f"Importing data into {self.database_path} failed, see the error above")
+        print(f"Imported {len(users)} users, {len(transactions)} transactions and "
+              f"{len(history)} history records into {self.database_path} in {time.perf_counter() - started:.1f}s")
+    
+    # User operations
+    def get_all_users(self):
+        return self._keyed('SELECT user_id, data FROM users')
+    
+    def get_user(self, user_id):
+        return self._record('SELECT data FROM users WHERE user_id = ?', (int(user_id),))
+    
+    def save_user(self, user_data):
+        return self._run("save user", lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)',
+            (int(user_data['user_id']), _dumps(user_data))))
+    
+    def save_all_users(self, users_data):
+        def work(conn):
+            conn.execute('DELETE FROM users')
+            conn.executemany('INSERT INTO users (user_id, data) VALUES (?, ?)',
+                             [(int(user_id), _dumps(user)) for user_id, user in users_data.items()])
+        return self._run("save users", work)
+    
+    def save_users(self, users_data):
+        """Save several users in one transaction"""
+        return self._run("save users", lambda conn: conn.executemany(
+            'INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)',
+            [(int(user_id), _dumps(user)) for user_id, user in users_data.items()]))
+    
+    # Investment operations
+    def _investment_row(self, investment):
+        return (investment.get('id'), investment.get('investor_id'), investment.get('subject_id'), _dumps(investment))
+    
+    def get_all_investments(self):
+        return self._records('SELECT data FROM investments ORDER BY id')
+    
+    def save_investment(self, investment_data):
+        def work(conn):
+            if 'id' not in investment_data:
+                cursor = conn.execute("INSERT INTO investments (investor_id, subject_id, data) VALUES (?, ?, '{}')",
+                                      (investment_data.get('investor_id'), investment_data.get('subject_id')))
+                investment_data['id'] = cursor.lastrowid
+            conn.execute('INSERT OR REPLACE INTO investments (id, investor_id, subject_id, data) VALUES (?, ?, ?, ?)',
+                         self._investment_row(investment_data))
+        return self._run("save investment", work)
+    
+    def update_investment(self, investment_id, updates):
+        def work(conn):
+            row = conn.execute('SELECT data FROM investments WHERE id = ?', (investment_id,)).fetchone()
+            if row is None:
+                return False
+            investment = {**json.loads(row['data']), **updates}
+            conn.execute('INSERT OR REPLACE INTO investments (id, investor_id, subject_id, data) VALUES (?, ?, ?, ?)',
+                         self._investment_row(investment))
+        return self._run("update investment", work)
+    
+    def remove_investment(self, investment_id):
+        # Removing an unknown investment is not an error
+        return self._run("remove investment", lambda conn: conn.execute(
+            'DELETE FROM investments WHERE id = ?', (investment_id,)))
+    
+    def save_investment_changes(self, changed, removed_ids):
+        """Write back changed investment rows and delete removed ones in one transaction"""
+        def work(conn):
+            conn.executemany('INSERT OR REPLACE INTO investments (id, investor_id, subject_id, data) VALUES (?, ?, ?, ?)',
+                             [self._investment_row(investment) for investment in changed])
+            conn.executemany('DELETE FROM investments WHERE id = ?', [(investment_id,) for investment_id in removed_ids])
+        return self._run("save investment changes", work)
+    
+    # Transaction operations
+    def _transaction_row(self, transaction):
+        return (transaction.get('id'), transaction.get('user_id'), transaction.get('type'),
+                transaction.get('created_at'), _dumps(transaction))
+    
+    def get_all_transactions(self):
+        return self._records('SELECT data FROM transactions ORDER BY id')
+    
+    def save_transaction(self, transaction_data):
+        transaction_data['created_at'] = datetime.now().isoformat()
+        def work(conn):
+            cursor = conn.execute("INSERT INTO transactions (user_id, type, created_at, data) VALUES (?, ?, ?, '{}')",
+                                  self._transaction_row(transaction_data)[1:4])
+            transaction_data['id'] = cursor.lastrowid
+            conn.execute('UPDATE transactions SET data = ? WHERE id = ?', (_dumps(transaction_data), cursor.lastrowid))
+        return self._run("save transaction", work)
+    
+    def save_transaction_batch(self, transactions):
+        """Record several transactions in one transaction"""
+        created_at = datetime.now().isoformat()
+        def work(conn):
+            # Writers hold self.lock, so the ids can be numbered up front
+            (last_id,) = conn.execute('SELECT COALESCE(MAX(id), 0) FROM transactions').fetchone()
+            for offset, transaction_data in enumerate(transactions, 1):
+                transaction_data['created_at'] = created_at
+                transaction_data['id'] = last_id + offset
+            conn.executemany('INSERT INTO transactions (id, user_id, type, created_at, data) VALUES (?, ?, ?, ?, ?)',
+                             [self._transaction_row(transaction_data) for transaction_data in transactions])
+        return self._run("save transactions", work)
+    
+    # History operations
+    def get_history_rows(self, start=None, end=None, user_id=None):
+        conditions = []
+        parameters = []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            parameters.append(user_id)
+        if start is not None:
+            conditions.append('recorded_at >= ?')
+            parameters.append(start)
+        if end is not None:
+            conditions.append('recorded_at < ?')
+            parameters.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        cursor = self.pool.get().cursor()
+        # Plain tuples convert straight into packed rows
+        cursor.row_factory = None
+        rows = cursor.execute(f'''
+            SELECT user_id, recorded_at, stock_value, message_count, spam_penalty
+            FROM stock_history {where}
             ORDER BY recorded_at
-        ''', (user_id, f'-{days} days'))
-        return cursor.fetchall()
+        ''', parameters).fetchall()
+        return np.array(rows, dtype=HistorySegmentStore.RECORD_DTYPE)
+
+    def _insert_history_rows(self, rows):
+        return self._run("save history", lambda conn: conn.executemany(
+            'INSERT INTO stock_history (user_id, recorded_at, stock_value, message_count, spam_penalty) '
+            'VALUES (?, ?, ?, ?, ?)', rows.tolist()))
+    
+    def save_history_batch(self, history_records):
+        """Save several history records in one transaction"""
+        recorded_at = datetime.now().isoformat()
+        for history_data in history_records:
+            history_data.setdefault('recorded_at', recorded_at)
+        return self._insert_history_rows(HistorySegmentStore.to_rows(history_records))
+    
+    def prune_history(self, cutoff):
+        result = self._run("prune history", lambda conn: conn.execute(
+            'DELETE FROM stock_history WHERE recorded_at < ?', (cutoff,)).rowcount)
+        return result or 0
+    
+    # Candle operations
+    def get_all_candles(self):
+        return self._keyed('SELECT key, data FROM candles')
+    
+    def save_candles(self, candles):
+        """Save {key: candle} records in one transaction"""
+        return self._run("save candles", lambda conn: conn.executemany(
+            'INSERT OR REPLACE INTO candles (key, data) VALUES (?, ?)',
+            [(key, _dumps(candle)) for key, candle in candles.items()]))
+    
+    def remove_candles(self, keys):
+        return self._run("remove candles", lambda conn: conn.executemany(
+            'DELETE FROM candles WHERE key = ?', [(key,) for key in keys]))
+    
+    # Spam tracking operations
+    def get_spam_data(self):
+        return self._keyed('SELECT user_id, data FROM spam_tracker')
+    
+    def save_spam_data(self, spam_data):
+        def work(conn):
+            conn.execute('DELETE FROM spam_tracker')
+            conn.executemany('INSERT INTO spam_tracker (user_id, data) VALUES (?, ?)',
+                             [(str(user_id), _dumps(data)) for user_id, data in spam_data.items()])
+        return self._run("save spam data", work)
+    
+    def update_user_spam_data(self, user_id, spam_data):
+        return self.update_spam_data_batch({user_id: spam_data})
+    
+    def update_spam_data_batch(self, spam_updates):
+        """Save spam data for several users in one transaction"""
+        return self._run("save spam data", lambda conn: conn.executemany(
+            'INSERT OR REPLACE INTO spam_tracker (user_id, data) VALUES (?, ?)',
+            [(str(user_id), _dumps(data)) for user_id, data in spam_updates.items()]))
+    
+    # Company operations
+    def get_all_companies(self):
+        return self._keyed('SELECT company_id, data FROM companies')
+    
+    def get_company(self, company_id):
+        return self._record('SELECT data FROM companies WHERE company_id = ?', (str(company_id),))
+    
+    def save_company(self, company_data):
+        return self._run("save company", lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO companies (company_id, data) VALUES (?, ?)',
+            (str(company_data['id']), _dumps(company_data))))
+    
+    def save_companies(self, companies_data):
+        """Save several companies in one transaction"""
+        return self._run("save companies", lambda conn: conn.executemany(
+            'INSERT OR REPLACE INTO companies (company_id, data) VALUES (?, ?)',
+            [(str(company_id), _dumps(company)) for company_id, company in companies_data.items()]))
+    
+    def update_company(self, company_id, updates):
+        def work(conn):
+            row = conn.execute('SELECT data FROM companies WHERE company_id = ?', (str(company_id),)).fetchone()
+            if row is None:
+                return False
+            conn.execute('UPDATE companies SET data = ? WHERE company_id = ?',
+                         (_dumps({**json.loads(row['data']), **updates}), str(company_id)))
+        return self._run("update company", work)
+    
+    def remove_company(self, company_id):
+        return self._run("remove company", lambda conn: conn.execute(
+            'DELETE FROM companies WHERE company_id = ?', (str(company_id),)))
+    
+    # Employee operations
+    def get_all_employees(self):
+        return self._keyed('SELECT user_id, data FROM employees')
+    
+    def get_employee(self, user_id):
+        return self._record('SELECT data FROM employees WHERE user_id = ?', (str(user_id),))
+    
+    def save_employee(self, employee_data):
+        return self._run("save employee", lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO employees (user_id, company_id, data) VALUES (?, ?, ?)',
+            (str(employee_data['user_id']), _text(employee_data.get('company_id')), _dumps(employee_data))))
+    
+    def update_employee(self, user_id, updates):
+        def work(conn):
+            row = conn.execute('SELECT data FROM employees WHERE user_id = ?', (str(user_id),)).fetchone()
+            if row is None:
+                return False
+            employee = {**json.loads(row['data']), **updates}
+            conn.execute('UPDATE employees SET company_id = ?, data = ? WHERE user_id = ?',
+                         (_text(employee.get('company_id')), _dumps(employee), str(user_id)))
+        return self._run("update employee", work)
+    
+    def remove_employee(self, user_id):
+        return self._run("remove employee", lambda conn: conn.execute(
+            'DELETE FROM employees WHERE user_id = ?', (str(user_id),)))
+    
+    def save_employee_changes(self, changed, removed_ids):
+        """Save changed employees and remove others in one transaction"""
+        def work(conn):
+            conn.executemany('INSERT OR REPLACE INTO employees (user_id, company_id, data) VALUES (?, ?, ?)',
+                             [(str(user_id), _text(employee.get('company_id')), _dumps(employee))
+                              for user_id, employee in changed.items()])
+            conn.executemany('DELETE FROM employees WHERE user_id = ?', [(str(user_id),) for user_id in removed_ids])
+        return self._run("save employee changes", work)
+    
+    # Task and deal operations
+    #
+    # Tasks and deals are numbered per company, like the lists the JSON
+    # backend keeps under each company id.
+    def _get_company_items(self, table, company_id):
+        return self._records(f'SELECT data FROM {table} WHERE company_id = ? ORDER BY id', (str(company_id),))
+    
+    def _get_all_items(self, table):
+        items = {}
+        for row in self._query(f'SELECT company_id, data FROM {table} ORDER BY company_id, id'):
+            items.setdefault(row['company_id'], []).append(json.loads(row['data']))
+        return items
+    
+    def _save_company_items(self, table, company_id, items):
+        return self._save_items(table, {company_id: items})
+    
+    def _save_items(self, table, items_by_company):
+        """Replace the items of each company in items_by_company in one transaction"""
+        def work(conn):
+            conn.executemany(f'DELETE FROM {table} WHERE company_id = ?',
+                             [(str(company_id),) for company_id in items_by_company])
+            conn.executemany(f'INSERT INTO {table} (company_id, id, data) VALUES (?, ?, ?)',
+                             [(str(company_id), item.get('id'), _dumps(item))
+                              for company_id, items in items_by_company.items() for item in items])
+        return self._run(f"save {table}", work)
+    
+    def _add_company_item(self, table, company_id, item):
+        def work(conn):
+            (last_id,) = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table} WHERE company_id = ?',
+                                      (str(company_id),)).fetchone()
+            item['id'] = last_id + 1
+            item['created_at'] = datetime.now().isoformat()
+            conn.execute(f'INSERT INTO {table} (company_id, id, data) VALUES (?, ?, ?)',
+                         (str(company_id), item['id'], _dumps(item)))
+        return self._run(f"add to {table}", work)
+    
+    def _update_company_item(self, table, company_id, item_id, updates):
+        def work(conn):
+            row = conn.execute(f'SELECT data FROM {table} WHERE company_id = ? AND id = ?',
+                               (str(company_id), item_id)).fetchone()
+            if row is None:
+                return False
+            conn.execute(f'UPDATE {table} SET data = ? WHERE company_id = ? AND id = ?',
+                         (_dumps({**json.loads(row['data']), **updates}), str(company_id), item_id))
+        return self._run(f"update {table}", work)
+    
+    def _remove_company_item(self, table, company_id, item_id):
+        return self._run(f"remove from {table}", lambda conn: conn.execute(
+            f'DELETE FROM {table} WHERE company_id = ? AND id = ?', (str(company_id), item_id)))
+    
+    def get_all_tasks(self):
+        return self._get_all_items('tasks')
+    
+    def get_company_tasks(self, company_id):
+        return self._get_company_items('tasks', company_id)
+    
+    def save_company_tasks(self, company_id, tasks):
+        return self._save_company_items('tasks', company_id, tasks)
+    
+    def save_tasks(self, tasks_data):
+        return self._save_items('tasks', tasks_data)
+    
+    def add_company_task(self, company_id, task_data):
+        return self._add_company_item('tasks', company_id, task_data)
+    
+    def update_company_task(self, company_id, task_id, updates):
+        return self._update_company_item('tasks', company_id, task_id, updates)
+    
+    def remove_company_task(self, company_id, task_id):
+        return self._remove_company_item('tasks', company_id, task_id)
+    
+    def get_all_deals(self):
+        return self._get_all_items('deals')
+    
+    def get_company_deals(self, company_id):
+        return self._get_company_items('deals', company_id)
+    
+    def save_company_deals(self, company_id, deals):
+        return self._save_company_items('deals', company_id, deals)
+    
+    def save_deals(self, deals_data):
+        return self._save_items('deals', deals_data)
+    
+    def add_company_deal(self, company_id, deal_data):
+        return self._add_company_item('deals', company_id, deal_data)
+    
+    def update_company_deal(self, company_id, deal_id, updates):
+        return self._update_company_item('deals', company_id, deal_id, updates)
+    
+    def remove_company_deal(self, company_id, deal_id):
+        return self._remove_company_item('deals', company_id, deal_id)
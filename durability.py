@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+
+class DurableFiles:
+    """Crash-safe file writes, replacing files through a temp file, with a configurable fsync policy"""
+    
+    # 'none' leaves flushing to the OS. 'batch' fsyncs a replaced file before
+    # its rename but groups the directory and append fsyncs of writes made
+    # within batch_window of each other, so a power loss can take that
+    # window's writes but never half a file. 'always' fsyncs every write.
+    MODES = ('none', 'batch', 'always')
+    
+    def __init__(self, mode, batch_window=0.05):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown durability mode '{mode}', expected one of {', '.join(self.MODES)}")
+        self.mode = mode
+        self.batch_window = batch_window
+        self.lock = threading.Lock()
+        # Paths written since the last group commit, and their directories
+        self._pending_files = set()
+        self._pending_dirs = set()
+        self._commit_timer = None
+        self.stats = {'writes': 0, 'fsyncs': 0, 'commits': 0}
+    
+    @staticmethod
+    def _fsync_path(path, directory=False):
+        if directory and os.name != 'posix':
+            # Directories can't be opened for fsync outside POSIX
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def _synced(self, path, fileno=None, directory=None):
+        """Apply the durability mode to a file that was just written"""
+        with self.lock:
+            self.stats['writes'] += 1
+            if self.mode == 'none':
+                return
+            if self.mode == 'always':
+                if fileno is not None:
+                    os.fsync(fileno)
+                    self.stats['fsyncs'] += 1
+                if directory is not None:
+                    self._fsync_path(directory, directory=True)
+                    self.stats['fsyncs'] += 1
+                return
+            
+            # Replaced files were synced before their rename, only appends wait
+            if fileno is not None:
+                self._pending_files.add(path)
+            if directory is not None:
+                self._pending_dirs.add(directory)
+            if self._commit_timer is None:
+                # The first write of a group starts the window the rest join
+                self._commit_timer = threading.Timer(self.batch_window, self.commit)
+                self._commit_timer.daemon = True
+                self._commit_timer.start()
+    
+    def write_atomic(self, path, data):
+        """Replace a file's contents with data without ever exposing a partial write"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            # The contents must be on disk before the rename makes them
+            # visible, or a power loss could leave the target empty
+            if self.mode != 'none':
+                os.fsync(f.fileno())
+                with self.lock:
+                    self.stats['fsyncs'] += 1
+        os.replace(temp_path, path)
+        # The rename itself is only durable once the directory is synced
+        self._synced(path, directory=os.path.dirname(path) or '.')
+    
+    def append(self, handle):
+        """Flush an append-mode handle and apply the durability mode to it"""
+        handle.flush()
+        self._synced(handle.name, handle.fileno())
+    
+    def commit(self):
+        """Fsync every file and directory written since the last commit"""
+        with self.lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+            files, self._pending_files = self._pending_files, set()
+            directories, self._pending_dirs = self._pending_dirs, set()
+            
+            started = time.perf_counter()
+            for path in files:
+                try:
+                    self._fsync_path(path)
+                except FileNotFoundError:
+                    # Replaced or removed since it was written
+                    continue
+                self.stats['fsyncs'] += 1
+            for directory in directories:
+                self._fsync_path(directory, directory=True)
+                self.stats['fsyncs'] += 1
+            if files or directories:
+                self.stats['commits'] += 1
+            return time.perf_counter() - started
+    
+    @staticmethod
+    def remove_stale_temp_files(directory):
+        """Delete temp files left behind by a crash mid-write"""
+        removed = 0
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+                removed += 1
+        return removed
@@ -1,145 +1,451 @@
+import asyncio
 import random
 import time
 import threading
 import math
+from collections import deque
 from datetime import datetime, timedelta
-from data_handler import JSONDataHandler
+import numpy as np
+import config
+from storage import create_storage
+from candles import CandleStore
+from investment_book import InvestmentBook
+from price_history import PriceHistoryStore
+from leaderboard import Leaderboard
+from payroll import plan_payroll, PayrollSchedule
+from membership import MembershipIndex
 
 class EconomySystem:
+    SPAM_WINDOW_SIZE = 10  # Using constant instead of config
+    TREND_WINDOWS = (7, 30)  # Trend windows (in days) with incrementally kept bounds
+    
     def __init__(self):
-        self.data_handler = JSONDataHandler()
+        started = time.perf_counter()
+        self.data_handler = create_storage()
+        self.startup_timings = {'storage': time.perf_counter() - started}
         self.users_cache = {}
+        # Users and companies changed since they were last written, and
+        # employees and companies whose tasks or deals changed
+        self.dirty_users = set()
+        self.dirty_companies = set()
+        self.dirty_employees = set()
+        self.dirty_tasks = set()
+        self.dirty_deals = set()
+        self.leaderboard = Leaderboard()
         self.pending_history = []
+        self.pending_transactions = []
+        self.investment_book = InvestmentBook()
+        # Guards the caches and the structures kept alongside them (investment
+        # book, leaderboard, candles, membership, payroll schedule), none of
+        # which have a lock of their own
         self.cache_lock = threading.RLock()
+        self.sync_lock = threading.Lock()
         self.last_sync_time = 0
-        self.price_history = {}
+        self.price_history = PriceHistoryStore()
+        self.candles = CandleStore()
+        self.last_retention_run = 0
+        self.history_load_mode = config.HISTORY_LOAD_MODE
+        self.history_hydration_lock = threading.Lock()
+        self.price_history_ready = threading.Event()
+        # Users whose history was hydrated on first use, in lazy mode
+        self.hydrated_users = set()
+        self.startup_time = time.time()
         self.spam_tracker = {}
+        self.dirty_spam_users = set()
         self.companies_cache = {}
-        self.last_salary_payment = time.time()
+        self.tasks_cache = {}
+        self.deals_cache = {}
+        self.membership = MembershipIndex(config.ROLE_PERMISSIONS)
+        self.payroll_schedule = PayrollSchedule(config.EMPLOYEE_SALARY_INTERVAL)
         
         # Load initial data
         self.load_from_storage()
     
-    def _load_price_history(self):
-        """Load and process price history for trend analysis"""
-        history = self.data_handler.get_all_history()
-        self.price_history = {}
-        
-        for record in history:
-            user_id = record.get('user_id')
-            if user_id not in self.price_history:
-                self.price_history[user_id] = []
-            
-            # Convert timestamp to datetime if it's a string
-            timestamp = record.get('recorded_at')
-            if isinstance(timestamp, str):
-                try:
-                    timestamp = datetime.fromisoformat(timestamp).timestamp()
-                except ValueError:
-                    timestamp = time.time()
-            
-            self.price_history[user_id].append({
-                'timestamp': timestamp,
-                'price': record.get('stock_value', 10.0),
-                'message_count': record.get('message_count', 0)
-            })
+    def _read_price_history(self, all_history=False, user_id=None):
+        """Read price history from before startup, for everyone or one user, into a new PriceHistoryStore"""
+        # Only the chart window is needed, unless all of it is being rolled up
+        start = None if all_history else self.startup_time - (config.CHART_DAYS_LIMIT * 24 * 3600)
+        rows = self.data_handler.get_history_rows(start, self.startup_time, user_id)
+        
+        # Raw points are only kept for a couple of days, so seed each user's
+        # older history with the closes of the hourly candles before it
+        order = np.argsort(rows['timestamp'], kind='stable')
+        raw_users, first_indices = np.unique(rows['user_id'][order], return_index=True)
+        first_raw = dict(zip(raw_users.tolist(), rows['timestamp'][order][first_indices].tolist()))
+        seed_user_ids = []
+        seed_timestamps = []
+        seed_prices = []
+        seed_message_counts = []
+        with self.cache_lock:
+            hourly = self.candles.candles['hour']
+            if user_id is not None:
+                hourly = {user_id: hourly[user_id]} if user_id in hourly else {}
+            for candle_user_id, by_start in hourly.items():
+                for start, candle in by_start.items():
+                    end = start + CandleStore.RESOLUTIONS['hour']
+                    if end <= min(first_raw.get(candle_user_id, end), self.startup_time):
+                        seed_user_ids.append(candle_user_id)
+                        seed_timestamps.append(end)
+                        seed_prices.append(candle['close'])
+                        seed_message_counts.append(candle['message_count'])
+        
+        user_ids = np.concatenate((rows['user_id'], np.array(seed_user_ids, dtype=np.int64)))
+        timestamps = np.concatenate((rows['timestamp'], np.array(seed_timestamps, dtype=np.float64)))
+        prices = np.concatenate((rows['price'], np.array(seed_prices, dtype=np.float64)))
+        message_counts = np.concatenate((rows['message_count'], np.array(seed_message_counts, dtype=np.int64)))
+        
+        # The store sorts each user's history by timestamp
+        loaded = PriceHistoryStore()
+        loaded.load(user_ids, timestamps, prices, message_counts)
+        return loaded
+    
+    def _hydrate_price_history(self, all_history=False):
+        """Load price history from before startup under the points recorded since"""
+        with self.history_hydration_lock:
+            if self.price_history_ready.is_set():
+                return
+            started = time.perf_counter()
+            loaded = self._read_price_history(all_history)
+            with self.cache_lock:
+                self.price_history.prepend(loaded)
+            self.startup_timings['price_history'] = time.perf_counter() - started
+            self.price_history_ready.set()
         
-        # Sort all history by timestamp
-        for user_id in self.price_history:
-            self.price_history[user_id].sort(key=lambda x: x['timestamp'])
+        if self.history_load_mode != 'eager':
+            points = sum(len(series) for series in loaded.series.values())
+            print(f"Hydrated {points} price history points in {self.startup_timings['price_history'] * 1000:.1f} ms")
+    
+    def _needs_price_history(self, user_id):
+        return (self.history_load_mode == 'lazy' and not self.price_history_ready.is_set() and
+                user_id not in self.hydrated_users)
+    
+    def _hydrate_user_price_history(self, user_ids):
+        """Hydrate the price history of users that haven't been hydrated yet"""
+        with self.history_hydration_lock:
+            for user_id in user_ids:
+                if user_id in self.hydrated_users:
+                    continue
+                loaded = self._read_price_history(user_id=user_id)
+                with self.cache_lock:
+                    self.price_history.prepend(loaded)
+                self.hydrated_users.add(user_id)
+    
+    async def load_price_history(self, user_ids):
+        """In lazy mode, hydrate users' price history in an executor before commands use it"""
+        user_ids = [user_id for user_id in user_ids if self._needs_price_history(user_id)]
+        if user_ids:
+            await asyncio.get_running_loop().run_in_executor(None, self._hydrate_user_price_history, user_ids)
+    
+    def _end_phase(self, phase, started):
+        """Record how long a startup phase took and return when the next one starts"""
+        now = time.perf_counter()
+        self.startup_timings[phase] = now - started
+        return now
     
     def load_from_storage(self):
         """Load all user data from storage into cache"""
         with self.cache_lock:
+            started = time.perf_counter()
             users_data = self.data_handler.get_all_users()
             self.users_cache = {int(user_id): user_data for user_id, user_data in users_data.items()}
+            self.dirty_users = set()
+            started = self._end_phase('users', started)
+            self.leaderboard.load({user_id: user_data['stock_value'] for user_id, user_data in self.users_cache.items()})
+            started = self._end_phase('leaderboard', started)
             self.last_sync_time = time.time()
             
             # Load spam tracking data
             spam_data = self.data_handler.get_spam_data()
-            self.spam_tracker = {int(user_id): data for user_id, data in spam_data.items()}
+            self.spam_tracker = {}
+            for user_id, data in spam_data.items():
+                data['message_times'] = deque(data.get('message_times', []), maxlen=self.SPAM_WINDOW_SIZE)
+                self.spam_tracker[int(user_id)] = data
+            self.dirty_spam_users = set()
+            started = self._end_phase('spam_tracker', started)
             
             # Load companies data
             companies_data = self.data_handler.get_all_companies()
             self.companies_cache = {int(company_id): company_data for company_id, company_data in companies_data.items()}
-            
-            # Initialize price history
-            self._load_price_history()
+            self.dirty_companies = set()
+            # Companies without a payroll cycle yet get one and are written back
+            self.dirty_companies.update(self.payroll_schedule.load(self.companies_cache, time.time()))
+            started = self._end_phase('companies', started)
+            self.membership.load(self.data_handler.get_all_employees())
+            self.dirty_employees = set()
+            started = self._end_phase('employees', started)
+            self.tasks_cache = {int(company_id): tasks for company_id, tasks in self.data_handler.get_all_tasks().items()}
+            self.deals_cache = {int(company_id): deals for company_id, deals in self.data_handler.get_all_deals().items()}
+            self.dirty_tasks = set()
+            self.dirty_deals = set()
+            started = self._end_phase('tasks_and_deals', started)
+            
+            # Load investment positions
+            self.investment_book.load(self.data_handler.get_all_investments())
+            started = self._end_phase('investments', started)
+            
+            # Load candles before the price history, which is seeded from them
+            self.candles.load(self.data_handler.get_all_candles().values())
+            started = self._end_phase('candles', started)
+            
+            # Initialize price history. The first start with candles has to
+            # roll up all existing history, so it always loads eagerly.
+            self.startup_time = time.time()
+            self.price_history = PriceHistoryStore()
+            self.price_history_ready.clear()
+            self.hydrated_users = set()
+            backfill_candles = not len(self.candles)
+            if self.history_load_mode == 'eager' or backfill_candles:
+                self._hydrate_price_history(all_history=backfill_candles)
+            
+            if backfill_candles:
+                for user_id, series in self.price_history.series.items():
+                    for timestamp, price, message_count in zip(series.timestamps[:series.size].tolist(),
+                                                               series.prices[:series.size].tolist(),
+                                                               series.message_counts[:series.size].tolist()):
+                        self.candles.add_point(user_id, timestamp, price, message_count)
+                self._end_phase('candle_backfill', started)
+        
+        # Hydrate in the background without holding up startup
+        if self.history_load_mode == 'background' and not self.price_history_ready.is_set():
+            threading.Thread(target=self._hydrate_price_history, name='history-hydration', daemon=True).start()
+        
+        report = ', '.join(f"{phase} {seconds * 1000:.1f} ms" for phase, seconds in self.startup_timings.items())
+        print(f"Loaded storage in {sum(self.startup_timings.values()) * 1000:.1f} ms ({report})")
+    
+    @staticmethod
+    def _copy_record(record):
+        """Copy a cached record and the lists and dicts in it, whose entries are replaced rather than modified"""
+        return {key: value.copy() if isinstance(value, (list, dict)) else value for key, value in record.items()}
     
     def sync_to_storage(self):
-        """Synchronize cache to storage"""
-        with self.cache_lock:
-            if not self.users_cache:
-                return
-                
-            # Update users in storage
-            users_to_update = {}
+        """Synchronize cache to storage and return stats about what was written"""
+        stats = {'users': 0, 'companies': 0, 'history_rows': 0, 'history_seconds': 0.0, 'candles': 0, 'pruned_rows': 0}
+        with self.sync_lock:
             current_time = time.time()
             
-            for user_id, user_data in self.users_cache.items():
-                if user_data.get('last_updated', 0) > self.last_sync_time:
-                    users_to_update[str(user_id)] = user_data
+            # Pay companies whose payroll is due, so the payments go out with this sync
+            self.process_salary_payments(current_time)
             
+            # Take copies of everything waiting to be written, so the writes
+            # below can run without cache_lock
+            with self.cache_lock:
+                if not self.users_cache:
+                    return stats
+                
+                dirty_users, self.dirty_users = self.dirty_users, set()
+                users_to_update = {str(user_id): self._copy_record(self.users_cache[user_id])
+                                   for user_id in dirty_users if user_id in self.users_cache}
+                dirty_companies, self.dirty_companies = self.dirty_companies, set()
+                companies_to_update = {str(company_id): self._copy_record(self.companies_cache[company_id])
+                                       for company_id in dirty_companies if company_id in self.companies_cache}
+                dirty_employees, self.dirty_employees = self.dirty_employees, set()
+                employees_to_update = {str(user_id): dict(self.membership.get(user_id))
+                                       for user_id in dirty_employees if self.membership.get(user_id)}
+                removed_employees = [user_id for user_id in dirty_employees if not self.membership.get(user_id)]
+                dirty_tasks, self.dirty_tasks = self.dirty_tasks, set()
+                tasks_to_update = {str(company_id): [dict(task) for task in self.tasks_cache.get(company_id, [])]
+                                   for company_id in dirty_tasks}
+                dirty_deals, self.dirty_deals = self.dirty_deals, set()
+                deals_to_update = {str(company_id): [dict(deal) for deal in self.deals_cache.get(company_id, [])]
+                                   for company_id in dirty_deals}
+                dirty_spam_users, self.dirty_spam_users = self.dirty_spam_users, set()
+                spam_updates = {}
+                for user_id in dirty_spam_users:
+                    user_tracker = self.spam_tracker[user_id]
+                    spam_updates[str(user_id)] = {**user_tracker, 'message_times': list(user_tracker['message_times'])}
+                history, self.pending_history = self.pending_history, []
+                transactions, self.pending_transactions = self.pending_transactions, []
+                changed, removed = self.investment_book.take_changes()
+            
+            # Write back changed users
             if users_to_update:
-                all_users = self.data_handler.get_all_users()
-                all_users.update(users_to_update)
-                self.data_handler.save_all_users(all_users)
-            
-            # Record history if needed
-            if self.pending_history:
-                for history_record in self.pending_history:
-                    self.data_handler.save_history(history_record)
-                self.pending_history = []
-            
-            # Update companies if needed
-            if self.companies_cache:
-                self.data_handler.save_all_companies(self.companies_cache)
-            
-            # Process salary payments
-            if current_time - self.last_salary_payment >= 86400:  # Using constant instead of config
-                self.process_salary_payments()
-                self.last_salary_payment = current_time
+                if self.data_handler.save_users(users_to_update):
+                    stats['users'] = len(users_to_update)
+                else:
+                    with self.cache_lock:
+                        self.dirty_users |= dirty_users
+            
+            # Record history, then roll the flushed points up into candles
+            history_saved = True
+            if history:
+                flush_start = time.perf_counter()
+                history_saved = self.data_handler.save_history_batch(history)
+                stats['history_seconds'] = time.perf_counter() - flush_start
+                with self.cache_lock:
+                    if history_saved:
+                        stats['history_rows'] = len(history)
+                        for record in history:
+                            self.candles.add_point(record['user_id'],
+                                                   datetime.fromisoformat(record['recorded_at']).timestamp(),
+                                                   record['stock_value'], record['message_count'])
+                    else:
+                        self.pending_history[:0] = history
+            
+            # Write back changed candles
+            with self.cache_lock:
+                candle_changes = self.candles.take_changes()
+            candles_saved = True
+            if candle_changes:
+                candles_saved = self.data_handler.save_candles(candle_changes)
+                if candles_saved:
+                    stats['candles'] = len(candle_changes)
+                else:
+                    with self.cache_lock:
+                        self.candles.restore_changes(candle_changes)
+            
+            # Apply the retention tiers: raw points and hourly candles expire,
+            # daily candles are kept. Raw points are only dropped once every
+            # candle they were rolled up into has been written.
+            if (current_time - self.last_retention_run >= config.HISTORY_RETENTION_INTERVAL and
+                    history_saved and candles_saved):
+                with self.cache_lock:
+                    self.candles.prune('hour', current_time - config.CANDLE_HOURLY_RETENTION)
+                    # Resident price history only has to cover the longest
+                    # trend or chart window
+                    window_days = max(self.TREND_WINDOWS + (config.CHART_DAYS_LIMIT,))
+                    self.price_history.prune(current_time - window_days * 24 * 3600)
+                stats['pruned_rows'] = self.data_handler.prune_history(current_time - config.HISTORY_RAW_RETENTION)
+                self.last_retention_run = current_time
+            
+            # Remove expired candles, including any a previous sync failed to
+            with self.cache_lock:
+                expired = self.candles.take_removed()
+            if expired and not self.data_handler.remove_candles(list(expired)):
+                with self.cache_lock:
+                    self.candles.restore_removed(expired)
+            
+            # Write back changed spam trackers
+            if spam_updates and not self.data_handler.update_spam_data_batch(spam_updates):
+                with self.cache_lock:
+                    self.dirty_spam_users |= dirty_spam_users
+            
+            # Write back investment changes
+            if changed or removed:
+                if not self.data_handler.save_investment_changes(changed, removed):
+                    with self.cache_lock:
+                        self.investment_book.restore_changes(changed, removed)
             
+            # Record transactions
+            if transactions and not self.data_handler.save_transaction_batch(transactions):
+                with self.cache_lock:
+                    self.pending_transactions[:0] = transactions
+            
+            # Write back changed companies
+            if companies_to_update:
+                if self.data_handler.save_companies(companies_to_update):
+                    stats['companies'] = len(companies_to_update)
+                else:
+                    with self.cache_lock:
+                        self.dirty_companies |= dirty_companies
+            
+            # Write back hires, firings, tasks and deals
+            if employees_to_update or removed_employees:
+                if not self.data_handler.save_employee_changes(employees_to_update, removed_employees):
+                    with self.cache_lock:
+                        self.dirty_employees |= dirty_employees
+            if tasks_to_update and not self.data_handler.save_tasks(tasks_to_update):
+                with self.cache_lock:
+                    self.dirty_tasks |= dirty_tasks
+            if deals_to_update and not self.data_handler.save_deals(deals_to_update):
+                with self.cache_lock:
+                    self.dirty_deals |= dirty_deals
+            
+            # Everything written above shares one group commit
+            self.data_handler.commit_writes()
             self.last_sync_time = current_time
+        
+        return stats
     
-    def process_salary_payments(self):
-        """Process salary payments for all employees"""
-        employees = self.data_handler.get_all_employees()
+    def process_salary_payments(self, now=None):
+        """Pay every company whose payroll is due and return a report, or None if none are"""
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        report = {'companies': 0, 'cycles': 0, 'dropped': 0, 'paid': 0, 'skipped': 0, 'total': 0.0, 'plan_seconds': 0.0}
         
-        for user_id_str, employee_data in employees.items():
-            user_id = int(user_id_str)
-            company_id = employee_data.get('company_id')
+        with self.cache_lock:
+            due = self.payroll_schedule.pop_due(self.companies_cache, now)
+            if not due:
+                return None
             
-            if company_id and company_id in self.companies_cache:
+            owing = {}
+            for company_id in due:
                 company = self.companies_cache[company_id]
-                salary = employee_data.get('salary', 0)
-                
-                # Check if company has enough funds
-                if company.get('funds', 0) >= salary:
-                    # Pay employee
-                    if user_id in self.users_cache:
-                        self.users_cache[user_id]['cash_balance'] += salary
-                        self.users_cache[user_id]['last_updated'] = time.time()
-                    
-                    # Deduct from company funds
-                    company['funds'] -= salary
-                    
-                    # Record transaction
-                    self.data_handler.save_transaction({
+                oldest = self.payroll_schedule.latest_cycle(company_id, now) - config.PAYROLL_MAX_CATCHUP_CYCLES + 1
+                if company['payroll_cycle'] < oldest:
+                    report['dropped'] += oldest - company['payroll_cycle']
+                    company['payroll_cycle'] = oldest
+                owing[company_id] = company
+            report['companies'] = len(owing)
+            
+            # One round per missed cycle, each seeing the funds left by the
+            # last. Users record the (company, cycle) they were paid for, so a
+            # cycle run again after a sync stopped between the users and
+            # companies writes doesn't credit them twice.
+            while owing:
+                plan = plan_payroll(self.membership.employees, owing)
+                for user_id, company_id, salary in plan['payments']:
+                    user_data = self.users_cache.get(user_id)
+                    paid = [company_id, owing[company_id]['payroll_cycle']]
+                    if user_data is None or user_data.get('payroll_paid') == paid:
+                        continue
+                    user_data['cash_balance'] += salary
+                    user_data['payroll_paid'] = paid
+                    report['paid'] += 1
+                    report['total'] += salary
+                    user_data['last_updated'] = time.time()
+                    self.dirty_users.add(user_id)
+                    self.pending_transactions.append({
                         'user_id': user_id,
                         'type': 'salary',
                         'amount': salary,
-                        'details': f"Salary from {company.get('name', 'Unknown Company')}"
+                        'details': f"Salary from {owing[company_id].get('name', 'Unknown Company')}"
                     })
+                for company_id, amount in plan['debits'].items():
+                    owing[company_id]['funds'] -= amount
+                
+                report['cycles'] += len(owing)
+                report['skipped'] += len(plan['skipped'])
+                report['plan_seconds'] += plan['seconds']
+                
+                for company_id, company in list(owing.items()):
+                    company['payroll_cycle'] += 1
+                    self.dirty_companies.add(company_id)
+                    if self.payroll_schedule.next_due(company_id, company) > now:
+                        self.payroll_schedule.add(company_id, company, now)
+                        del owing[company_id]
+        
+        report['seconds'] = time.perf_counter() - started
+        print(f"Payroll: {report['cycles']} cycles for {report['companies']} companies paid {report['paid']} salaries "
+              f"${report['total']:,.2f}, skipped {report['skipped']} for insufficient funds, "
+              f"dropped {report['dropped']} missed cycles, in {report['seconds'] * 1000:.1f} ms "
+              f"(planning {report['plan_seconds'] * 1000:.1f} ms)")
+        return report
+    
+    def preview_payroll(self, company_id=None):
+        """Plan the next payroll run, for one company or all of them, without paying anyone"""
+        with self.cache_lock:
+            return plan_payroll(self.membership.employees, self.companies_cache, company_id)
+    
+    def get_employee(self, user_id):
+        """Get a copy of a user's employee record, or None if they aren't employed"""
+        with self.cache_lock:
+            employee = self.membership.get(user_id)
+            return dict(employee) if employee else None
+    
+    def get_next_payroll_time(self, company_id):
+        """When a company's next payroll run is due, as a timestamp"""
+        with self.cache_lock:
+            company = self.companies_cache.get(company_id)
+            return self.payroll_schedule.next_due(company_id, company) if company else None
     
-    def is_spamming(self, user_id, message_content):
-        """Check if a user is spamming messages"""
-        current_time = time.time()
+    def is_spamming(self, user_id, message_content, current_time=None):
+        """Check if a user is spamming messages, sent at current_time if given"""
+        current_time = time.time() if current_time is None else current_time
         
         # Initialize spam tracking for new users
         if user_id not in self.spam_tracker:
             self.spam_tracker[user_id] = {
-                'message_times': [],
+                'message_times': deque(maxlen=self.SPAM_WINDOW_SIZE),
                 'last_penalty': 0,
                 'spam_count': 0
             }
@@ -156,34 +462,27 @@ class EconomySystem:
             if current_time - last_message_time < 15:  # Using constant instead of config
                 return True, "Message cooldown"
         
-        # Update message tracking
+        # Update message tracking (the ring buffer keeps only the last N messages)
         user_tracker['message_times'].append(current_time)
-        
-        # Keep only the last N messages (sliding window)
-        window_size = 10  # Using constant instead of config
-        if len(user_tracker['message_times']) > window_size:
-            user_tracker['message_times'] = user_tracker['message_times'][-window_size:]
+        self.dirty_spam_users.add(user_id)
         
         # Check if user is spamming (too many messages in short time)
-        if len(user_tracker['message_times']) >= window_size:
+        if len(user_tracker['message_times']) >= self.SPAM_WINDOW_SIZE:
             time_span = user_tracker['message_times'][-1] - user_tracker['message_times'][0]
             if time_span < 60:  # 10 messages in less than 60 seconds is spamming
                 user_tracker['spam_count'] += 1
                 user_tracker['last_penalty'] = current_time
                 return True, "Spam detected"
         
-        # Save updated spam data
-        self.data_handler.update_user_spam_data(user_id, user_tracker)
-        
         return False, "OK"
     
-    def calculate_spam_penalty(self, user_id):
+    def calculate_spam_penalty(self, user_id, current_time=None):
         """Calculate penalty factor for spamming users"""
         if user_id not in self.spam_tracker:
             return 1.0  # No penalty
         
         user_tracker = self.spam_tracker[user_id]
-        current_time = time.time()
+        current_time = time.time() if current_time is None else current_time
         
         # Reduce penalty over time (1 hour half-life)
         time_since_penalty = current_time - user_tracker.get('last_penalty', 0)
@@ -216,31 +515,50 @@ class EconomySystem:
     
     def calculate_trend(self, user_id, days=7):
         """Calculate price trend for a user"""
-        if user_id not in self.price_history or not self.price_history[user_id]:
-            return 0
-        
         cutoff = time.time() - (days * 24 * 3600)
-        recent_history = [point for point in self.price_history[user_id] 
-                         if point['timestamp'] >= cutoff]
-        
-        if len(recent_history) < 2:
-            return 0
-        
-        first_price = recent_history[0]['price']
-        last_price = recent_history[-1]['price']
+        with self.cache_lock:
+            series = self.price_history.get(user_id)
+            if series is None:
+                return 0
+            
+            # The 7- and 30-day windows keep a cursor to their first point
+            first = series.first_index(cutoff, days if days in self.TREND_WINDOWS else None)
+            last = len(series) - 1
+            
+            if last - first < 1:
+                return 0
+            
+            first_price = float(series.prices[first])
+            last_price = float(series.prices[last])
+            recent_messages = int(series.message_counts[last]) - int(series.message_counts[first])
         
         if first_price == 0:
             return 0
         
         trend_percent = ((last_price - first_price) / first_price) * 100
         
-        recent_messages = recent_history[-1]['message_count'] - recent_history[0]['message_count']
         message_momentum = min(1.0, recent_messages / 100)
         
         adjusted_trend = trend_percent + (message_momentum * 1.0)
         
         return adjusted_trend
     
+    def get_price_window(self, user_id, days):
+        """Get copies of a user's (timestamps, prices) over the last N days"""
+        cutoff = time.time() - (days * 24 * 3600)
+        with self.cache_lock:
+            timestamps, prices, _ = self.price_history.window(user_id, cutoff)
+            return timestamps.copy(), prices.copy()
+    
+    def get_candles(self, user_id, days):
+        """Get copies of a user's candles over the last N days and their resolution"""
+        resolution = 'hour' if days <= config.CHART_HOURLY_CANDLE_DAYS else 'day'
+        seconds = CandleStore.RESOLUTIONS[resolution]
+        cutoff = time.time() - (days * 24 * 3600)
+        with self.cache_lock:
+            candles = self.candles.get_candles(user_id, resolution, cutoff // seconds * seconds)
+            return [dict(candle) for candle in candles], resolution
+    
     def predict_future_price(self, user_id, days_ahead=1):
         """Predict future price based on trend"""
         trend = self.calculate_trend(user_id)
@@ -259,21 +577,24 @@ class EconomySystem:
         with self.cache_lock:
             if user_id in self.users_cache:
                 self.users_cache[user_id]['stock_value'] += price_increase
+                self.leaderboard.update(user_id, self.users_cache[user_id]['stock_value'])
                 self.users_cache[user_id]['last_updated'] = time.time()
+                self.dirty_users.add(user_id)
         
         return price_increase
     
     def update_user_activity(self, user_id, message_content):
         """Update user stats with anti-spam checks"""
-        # Check for spam
-        is_spam, reason = self.is_spamming(user_id, message_content)
-        spam_penalty = self.calculate_spam_penalty(user_id)
-        
+        self.update_user_activity_batch(user_id, [(time.time(), message_content)])
+    
+    def update_user_activity_batch(self, user_id, messages):
+        """Apply a user's (sent_at, content) messages as one price update, recording only the final price"""
         with self.cache_lock:
             current_time = time.time()
             
             # Get or create user in cache
-            if user_id not in self.users_cache:
+            is_new_user = user_id not in self.users_cache
+            if is_new_user:
                 self.users_cache[user_id] = {
                     'user_id': user_id,
                     'username': f"User_{user_id}",
@@ -285,49 +606,52 @@ class EconomySystem:
                 }
             
             user_data = self.users_cache[user_id]
+            self.dirty_users.add(user_id)
+            accepted = 0
             
-            # Update spam penalty
-            user_data['spam_penalty'] = spam_penalty
-            
-            # Only update if not spamming
-            if not is_spam:
-                # Update message count and cash balance (with penalty)
-                user_data['message_count'] += 1
-                user_data['cash_balance'] += 0.1 * spam_penalty
-                
-                # Calculate new base value (with penalty)
-                new_base_value = 10.0 + (user_data['message_count'] * 0.01 * spam_penalty)
-                
-                # Apply smoothing and controlled volatility
-                new_stock_value = self.calculate_smoothed_price(user_data, new_base_value)
-                
-                user_data['stock_value'] = new_stock_value
-                user_data['last_updated'] = current_time
+            for sent_at, message_content in messages:
+                # Check for spam
+                is_spam, reason = self.is_spamming(user_id, message_content, sent_at)
+                spam_penalty = self.calculate_spam_penalty(user_id, sent_at)
                 
-                # Add to pending history
-                self.pending_history.append({
-                    'user_id': user_id,
-                    'stock_value': new_stock_value,
-                    'message_count': user_data['message_count'],
-                    'spam_penalty': spam_penalty
-                })
-                
-                # Update price history
-                if user_id not in self.price_history:
-                    self.price_history[user_id] = []
-                
-                self.price_history[user_id].append({
-                    'timestamp': current_time,
-                    'price': new_stock_value,
-                    'message_count': user_data['message_count']
-                })
-            else:
-                # Still update last_updated but don't increase value
+                # Update spam penalty
+                user_data['spam_penalty'] = spam_penalty
                 user_data['last_updated'] = current_time
                 
-                # Log spam event
-                if is_spam and reason != "Message cooldown":
+                # Only update if not spamming
+                if not is_spam:
+                    # Update message count and cash balance (with penalty)
+                    user_data['message_count'] += 1
+                    user_data['cash_balance'] += 0.1 * spam_penalty
+                    
+                    # Calculate new base value (with penalty)
+                    new_base_value = 10.0 + (user_data['message_count'] * 0.01 * spam_penalty)
+                    
+                    # Apply smoothing and controlled volatility
+                    user_data['stock_value'] = self.calculate_smoothed_price(user_data, new_base_value)
+                    accepted += 1
+                elif reason != "Message cooldown":
+                    # Log spam event
                     print(f"Spam detected for user {user_id}: {reason}")
+            
+            if not accepted:
+                if is_new_user:
+                    self.leaderboard.update(user_id, user_data['stock_value'])
+                return
+            
+            self.leaderboard.update(user_id, user_data['stock_value'])
+            
+            # Add to pending history
+            self.pending_history.append({
+                'user_id': user_id,
+                'stock_value': user_data['stock_value'],
+                'message_count': user_data['message_count'],
+                'spam_penalty': user_data['spam_penalty'],
+                'recorded_at': datetime.fromtimestamp(current_time).isoformat()
+            })
+            
+            # Update price history
+            self.price_history.append(user_id, current_time, user_data['stock_value'], user_data['message_count'])
     
     def get_stock_price(self, user_id):
         """Get current stock price from cache"""
@@ -336,6 +660,16 @@ class EconomySystem:
                 return self.users_cache[user_id]['stock_value']
             return 10.0
     
+    def get_market_leaders(self, limit):
+        """Get copies of the top users by stock value"""
+        with self.cache_lock:
+            return [self.users_cache[user_id].copy() for user_id, _ in self.leaderboard.top(limit)]
+    
+    def get_market_rank(self, user_id):
+        """Get a user's market rank and the number of ranked users"""
+        with self.cache_lock:
+            return self.leaderboard.rank(user_id), len(self.leaderboard)
+    
     def get_user_data(self, user_id):
         """Get user data from cache"""
         with self.cache_lock:
@@ -345,103 +679,67 @@ class EconomySystem:
     
     def buy_stocks(self, investor_id, subject_id, amount):
         """Buy stocks of another user"""
-        # Get investor data
-        investor_data = self.get_user_data(investor_id)
-        if not investor_data:
-            return False, "Investor not found"
-            
-        # Get subject stock price
-        stock_price = self.get_stock_price(subject_id)
-        total_cost = stock_price * amount
-        
-        # Check if investor has enough funds
-        if investor_data['cash_balance'] < total_cost:
-            return False, "Insufficient funds"
-        
-        # Update investor's balance
         with self.cache_lock:
-            self.users_cache[investor_id]['cash_balance'] -= total_cost
-            self.users_cache[investor_id]['last_updated'] = time.time()
-        
-        # Check if investment already exists
-        investments = self.data_handler.get_all_investments()
-        existing_investment = None
-        
-        for investment in investments:
-            if (investment.get('investor_id') == investor_id and 
-                investment.get('subject_id') == subject_id):
-                existing_investment = investment
-                break
-        
-        if existing_investment:
-            # Update existing investment
-            new_shares = existing_investment['shares_owned'] + amount
-            self.data_handler.update_investment(
-                existing_investment['id'],
-                {'shares_owned': new_shares, 'purchase_price': stock_price}
-            )
-        else:
-            # Create new investment
-            self.data_handler.save_investment({
-                'investor_id': investor_id,
-                'subject_id': subject_id,
-                'shares_owned': amount,
-                'purchase_price': stock_price,
-                'invested_at': time.time()
+            # Get investor data
+            if investor_id not in self.users_cache:
+                return False, "Investor not found"
+            investor_data = self.users_cache[investor_id]
+            
+            # Get subject stock price
+            stock_price = self.get_stock_price(subject_id)
+            total_cost = stock_price * amount
+            
+            # Check if investor has enough funds
+            if investor_data['cash_balance'] < total_cost:
+                return False, "Insufficient funds"
+            
+            # Update investor's balance
+            investor_data['cash_balance'] -= total_cost
+            investor_data['last_updated'] = time.time()
+            self.dirty_users.add(investor_id)
+            
+            # Add to the position, creating it if needed
+            self.investment_book.buy(investor_id, subject_id, amount, stock_price)
+            
+            # Record transaction
+            self.pending_transactions.append({
+                'user_id': investor_id,
+                'type': 'buy',
+                'amount': total_cost,
+                'details': f"Bought {amount} shares of {subject_id} at ${stock_price:.2f}"
             })
         
-        # Record transaction
-        self.data_handler.save_transaction({
-            'user_id': investor_id,
-            'type': 'buy',
-            'amount': total_cost,
-            'details': f"Bought {amount} shares of {subject_id} at ${stock_price:.2f}"
-        })
-        
         return True, f"Successfully bought {amount} shares at ${stock_price:.2f} each"
     
     def sell_stocks(self, investor_id, subject_id, amount):
         """Sell stocks of another user"""
-        # Check if investment exists
-        investments = self.data_handler.get_all_investments()
-        investment = None
-        
-        for inv in investments:
-            if (inv.get('investor_id') == investor_id and 
-                inv.get('subject_id') == subject_id):
-                investment = inv
-                break
-        
-        if not investment or investment['shares_owned'] < amount:
-            return False, "Not enough shares to sell"
-            
-        # Get current stock price
-        stock_price = self.get_stock_price(subject_id)
-        total_value = stock_price * amount
-        
-        # Update investment
-        new_shares = investment['shares_owned'] - amount
-        if new_shares <= 0:
-            self.data_handler.remove_investment(investment['id'])
-        else:
-            self.data_handler.update_investment(
-                investment['id'],
-                {'shares_owned': new_shares}
-            )
-        
-        # Update investor's balance
         with self.cache_lock:
+            # Check if investment exists
+            investment = self.investment_book.get(investor_id, subject_id)
+            
+            if not investment or investment['shares_owned'] < amount:
+                return False, "Not enough shares to sell"
+            
+            # Get current stock price
+            stock_price = self.get_stock_price(subject_id)
+            total_value = stock_price * amount
+            
+            # Update investment
+            self.investment_book.sell(investor_id, subject_id, amount)
+            
+            # Update investor's balance
             if investor_id in self.users_cache:
                 self.users_cache[investor_id]['cash_balance'] += total_value
                 self.users_cache[investor_id]['last_updated'] = time.time()
-        
-        # Record transaction
-        self.data_handler.save_transaction({
-            'user_id': investor_id,
-            'type': 'sell',
-            'amount': total_value,
-            'details': f"Sold {amount} shares of {subject_id} at ${stock_price:.2f}"
-        })
+                self.dirty_users.add(investor_id)
+            
+            # Record transaction
+            self.pending_transactions.append({
+                'user_id': investor_id,
+                'type': 'sell',
+                'amount': total_value,
+                'details': f"Sold {amount} shares of {subject_id} at ${stock_price:.2f}"
+            })
         
         # Calculate profit/loss
         purchase_value = investment['purchase_price'] * amount
@@ -451,10 +749,20 @@ class EconomySystem:
         return True, f"Sold {amount} shares for ${total_value:.2f} " \
                      f"(P/L: ${profit_loss:+.2f}, {profit_loss_percent:+.2f}%)"
     
+    def get_investor_count(self, subject_id):
+        """Get the number of users invested in a subject"""
+        with self.cache_lock:
+            return self.investment_book.get_investor_count(subject_id)
+    
+    def get_investment_subjects(self, investor_id):
+        """Get the ids of the users an investor holds shares in"""
+        with self.cache_lock:
+            return [investment['subject_id'] for investment in self.investment_book.get_investor_positions(investor_id)]
+    
     def get_portfolio(self, investor_id):
         """Get user's investment portfolio"""
-        investments = self.data_handler.get_all_investments()
-        user_investments = [inv for inv in investments if inv.get('investor_id') == investor_id]
+        with self.cache_lock:
+            user_investments = self.investment_book.get_investor_positions(investor_id)
         
         portfolio = []
         total_value = 0
@@ -478,7 +786,8 @@ class EconomySystem:
                 'current_price': current_price,
                 'current_value': current_val,
                 'profit_loss': profit_loss,
-                'profit_loss_percent': profit_loss_percent
+                'profit_loss_percent': profit_loss_percent,
+                'trend': self.calculate_trend(subject_id)
             })
             
             total_value += current_val
@@ -498,6 +807,14 @@ class EconomySystem:
             'total_profit_loss_percent': ((total_value - total_invested) / total_invested * 100) if total_invested > 0 else 0
         }
     
+    @staticmethod
+    def _add_company_item(items_cache, company_id, item):
+        """Number a task or deal after its company's others and add it to the cache"""
+        items = items_cache.setdefault(company_id, [])
+        item['id'] = max([existing.get('id', 0) for existing in items] + [0]) + 1
+        item['created_at'] = datetime.now().isoformat()
+        items.append(item)
+    
     def create_company(self, user_id, name, description, initial_funds):
         """Create a new company"""
         with self.cache_lock:
@@ -506,8 +823,7 @@ class EconomySystem:
                 return False, "Insufficient funds"
             
             # Check if user is already in a company
-            employee_data = self.data_handler.get_employee(user_id)
-            if employee_data and employee_data.get('company_id'):
+            if self.membership.get(user_id):
                 return False, "You are already part of a company"
             
             # Create company
@@ -523,11 +839,14 @@ class EconomySystem:
                 'stock_value': 100.0  # Initial company value
             }
             
-            # Add to cache
+            # Add to cache and give it a payroll slot
             self.companies_cache[company_id] = company_data
+            self.payroll_schedule.add(company_id, company_data, time.time())
+            self.dirty_companies.add(company_id)
             
             # Deduct funds from user
             self.users_cache[user_id]['cash_balance'] -= initial_funds
+            self.dirty_users.add(user_id)
             
             # Create employee record for CEO
             employee_data = {
@@ -537,7 +856,8 @@ class EconomySystem:
                 'salary': 0,  # CEO doesn't take a salary initially
                 'joined_at': time.time()
             }
-            self.data_handler.save_employee(employee_data)
+            self.membership.add(employee_data)
+            self.dirty_employees.add(user_id)
             
             # Add to company employees list
             company_data['employees'].append({
@@ -547,7 +867,7 @@ class EconomySystem:
             })
             
             # Record transaction
-            self.data_handler.save_transaction({
+            self.pending_transactions.append({
                 'user_id': user_id,
                 'type': 'company_creation',
                 'amount': initial_funds,
@@ -566,17 +886,15 @@ class EconomySystem:
             company = self.companies_cache[company_id]
             
             # Check if hirer has permission
-            hirer_employee = self.data_handler.get_employee(hirer_id)
-            if not hirer_employee or hirer_employee.get('company_id') != company_id:
+            hirer_employee = self.membership.get(hirer_id)
+            if not hirer_employee or hirer_employee['company_id'] != company_id:
                 return False, "You are not part of this company"
             
-            hirer_role = hirer_employee.get('role', '')
-            if hirer_role not in ['CEO', 'Upper Management']:
+            if not self.membership.role_allows(hirer_employee.get('role', ''), 'hire'):
                 return False, "You don't have permission to hire employees"
             
             # Check if user is already employed
-            existing_employee = self.data_handler.get_employee(user_id)
-            if existing_employee and existing_employee.get('company_id'):
+            if self.membership.get(user_id):
                 return False, "This user is already employed"
             
             # Check if company has enough funds for salary
@@ -591,7 +909,8 @@ class EconomySystem:
                 'salary': salary,
                 'joined_at': time.time()
             }
-            self.data_handler.save_employee(employee_data)
+            self.membership.add(employee_data)
+            self.dirty_employees.add(user_id)
             
             # Add to company employees list
             company['employees'].append({
@@ -599,6 +918,7 @@ class EconomySystem:
                 'role': role,
                 'salary': salary
             })
+            self.dirty_companies.add(company_id)
             
             # Update user cache if user is online
             if user_id in self.users_cache:
@@ -610,6 +930,7 @@ class EconomySystem:
                     'name': company.get('name', 'Unknown Company'),
                     'role': role
                 })
+                self.dirty_users.add(user_id)
             
             return True, f"Successfully hired user as {role} with ${salary:,.2f} salary"
     
@@ -623,17 +944,16 @@ class EconomySystem:
             company = self.companies_cache[company_id]
             
             # Check if firer has permission
-            firer_employee = self.data_handler.get_employee(firer_id)
-            if not firer_employee or firer_employee.get('company_id') != company_id:
+            firer_employee = self.membership.get(firer_id)
+            if not firer_employee or firer_employee['company_id'] != company_id:
                 return False, "You are not part of this company"
             
             firer_role = firer_employee.get('role', '')
-            if firer_role not in ['CEO', 'Upper Management']:
+            if not self.membership.role_allows(firer_role, 'fire'):
                 return False, "You don't have permission to fire employees"
             
             # Check if user is employed by the company
-            employee_data = self.data_handler.get_employee(user_id)
-            if not employee_data or employee_data.get('company_id') != company_id:
+            if user_id not in self.membership.company_members(company_id):
                 return False, "This user is not employed by this company"
             
             # Cannot fire yourself if you're CEO
@@ -641,16 +961,19 @@ class EconomySystem:
                 return False, "CEOs cannot fire themselves"
             
             # Remove employee record
-            self.data_handler.remove_employee(user_id)
+            self.membership.remove(user_id)
+            self.dirty_employees.add(user_id)
             
             # Remove from company employees list
             company['employees'] = [emp for emp in company['employees'] if emp.get('user_id') != user_id]
+            self.dirty_companies.add(company_id)
             
             # Update user cache if user is online
             if user_id in self.users_cache:
                 user_data = self.users_cache[user_id]
                 if 'companies' in user_data:
                     user_data['companies'] = [comp for comp in user_data['companies'] if comp.get('id') != company_id]
+                    self.dirty_users.add(user_id)
             
             return True, "Successfully fired employee"
     
@@ -664,17 +987,15 @@ class EconomySystem:
             company = self.companies_cache[company_id]
             
             # Check if creator has permission
-            creator_employee = self.data_handler.get_employee(creator_id)
-            if not creator_employee or creator_employee.get('company_id') != company_id:
+            creator_employee = self.membership.get(creator_id)
+            if not creator_employee or creator_employee['company_id'] != company_id:
                 return False, "You are not part of this company"
             
-            creator_role = creator_employee.get('role', '')
-            if creator_role not in ['CEO', 'Upper Management', 'Management']:
+            if not self.membership.role_allows(creator_employee.get('role', ''), 'assign_task'):
                 return False, "You don't have permission to create tasks"
             
             # Check if assignee is part of the company
-            assignee_employee = self.data_handler.get_employee(assignee_id)
-            if not assignee_employee or assignee_employee.get('company_id') != company_id:
+            if assignee_id not in self.membership.company_members(company_id):
                 return False, "Assignee is not part of this company"
             
             # Check if company has enough funds for reward
@@ -688,11 +1009,11 @@ class EconomySystem:
                 'assignee_id': assignee_id,
                 'creator_id': creator_id,
                 'reward': reward,
-                'status': 'assigned',
-                'created_at': time.time()
+                'status': 'assigned'
             }
             
-            self.data_handler.add_company_task(company_id, task_data)
+            self._add_company_item(self.tasks_cache, company_id, task_data)
+            self.dirty_tasks.add(company_id)
             
             return True, f"Task '{title}' created with ${reward:,.2f} reward"
     
@@ -706,12 +1027,11 @@ class EconomySystem:
             company = self.companies_cache[company_id]
             
             # Check if user is part of the company
-            employee_data = self.data_handler.get_employee(user_id)
-            if not employee_data or employee_data.get('company_id') != company_id:
+            if user_id not in self.membership.company_members(company_id):
                 return False, "You are not part of this company"
             
             # Get task
-            tasks = self.data_handler.get_company_tasks(company_id)
+            tasks = self.tasks_cache.get(company_id, [])
             task = next((t for t in tasks if t.get('id') == task_id), None)
             
             if not task:
@@ -731,18 +1051,20 @@ class EconomySystem:
             # Update task status
             task['status'] = 'completed'
             task['completed_at'] = time.time()
-            self.data_handler.update_company_task(company_id, task_id, task)
+            self.dirty_tasks.add(company_id)
             
             # Pay reward to employee
             if user_id in self.users_cache:
                 self.users_cache[user_id]['cash_balance'] += reward
                 self.users_cache[user_id]['last_updated'] = time.time()
+                self.dirty_users.add(user_id)
             
             # Deduct from company funds
             company['funds'] -= reward
+            self.dirty_companies.add(company_id)
             
             # Record transaction
-            self.data_handler.save_transaction({
+            self.pending_transactions.append({
                 'user_id': user_id,
                 'type': 'task_reward',
                 'amount': reward,
@@ -765,12 +1087,11 @@ class EconomySystem:
             target_company = self.companies_cache[target_company_id]
             
             # Check if creator has permission
-            creator_employee = self.data_handler.get_employee(creator_id)
-            if not creator_employee or creator_employee.get('company_id') != company_id:
+            creator_employee = self.membership.get(creator_id)
+            if not creator_employee or creator_employee['company_id'] != company_id:
                 return False, "You are not part of this company"
             
-            creator_role = creator_employee.get('role', '')
-            if creator_role not in ['CEO', 'Upper Management']:
+            if not self.membership.role_allows(creator_employee.get('role', ''), 'create_deal'):
                 return False, "You don't have permission to create deals"
             
             # Check if company has enough funds for deal
@@ -783,15 +1104,12 @@ class EconomySystem:
                 'to_company_id': target_company_id,
                 'description': description,
                 'amount': amount,
-                'status': 'proposed',
-                'created_at': time.time()
+                'status': 'proposed'
             }
             
-            self.data_handler.add_company_deal(company_id, deal_data)
-            self.data_handler.add_company_deal(target_company_id, {
-                **deal_data,
-                'status': 'pending'
-            })
+            self._add_company_item(self.deals_cache, company_id, deal_data)
+            self._add_company_item(self.deals_cache, target_company_id, {**deal_data, 'status': 'pending'})
+            self.dirty_deals.update((company_id, target_company_id))
             
             return True, f"Deal proposed to {target_company.get('name', 'Unknown Company')} for ${amount:,.2f}"
     
@@ -805,16 +1123,15 @@ class EconomySystem:
             company = self.companies_cache[company_id]
             
             # Check if user has permission
-            employee_data = self.data_handler.get_employee(user_id)
-            if not employee_data or employee_data.get('company_id') != company_id:
+            employee_data = self.membership.get(user_id)
+            if not employee_data or employee_data['company_id'] != company_id:
                 return False, "You are not part of this company"
             
-            employee_role = employee_data.get('role', '')
-            if employee_role not in ['CEO', 'Upper Management']:
+            if not self.membership.role_allows(employee_data.get('role', ''), 'create_deal'):
                 return False, "You don't have permission to accept deals"
             
             # Get deal
-            deals = self.data_handler.get_company_deals(company_id)
+            deals = self.deals_cache.get(company_id, [])
             deal = next((d for d in deals if d.get('id') == deal_id), None)
             
             if not deal:
@@ -837,23 +1154,23 @@ class EconomySystem:
             # Transfer funds
             from_company['funds'] -= amount
             company['funds'] += amount
+            self.dirty_companies.update((from_company_id, company_id))
             
             # Update deal status
             deal['status'] = 'accepted'
             deal['accepted_at'] = time.time()
             deal['accepted_by'] = user_id
-            self.data_handler.update_company_deal(company_id, deal_id, deal)
             
             # Update deal in origin company
-            from_deals = self.data_handler.get_company_deals(from_company_id)
+            from_deals = self.deals_cache.get(from_company_id, [])
             from_deal = next((d for d in from_deals if d.get('id') == deal_id), None)
             if from_deal:
                 from_deal['status'] = 'accepted'
                 from_deal['accepted_at'] = time.time()
-                self.data_handler.update_company_deal(from_company_id, deal_id, from_deal)
+            self.dirty_deals.update((from_company_id, company_id))
             
             # Record transactions
-            self.data_handler.save_transaction({
+            self.pending_transactions.append({
                 'user_id': user_id,
                 'type': 'deal_accept',
                 'amount': amount,
@@ -870,13 +1187,13 @@ class EconomySystem:
         company = self.companies_cache[company_id].copy()
         
         # Add employee details
-        employees = self.data_handler.get_all_employees()
+        employees = self.membership.company_members(company_id)
         company['employee_details'] = []
         
         for emp in company.get('employees', []):
             user_id = emp.get('user_id')
-            if str(user_id) in employees:
-                emp_data = employees[str(user_id)]
+            if user_id in employees:
+                emp_data = employees[user_id]
                 company['employee_details'].append({
                     'user_id': user_id,
                     'role': emp_data.get('role', 'Unknown'),
@@ -885,9 +1202,9 @@ class EconomySystem:
                 })
         
         # Add tasks
-        company['tasks'] = self.data_handler.get_company_tasks(company_id)
+        company['tasks'] = [dict(task) for task in self.tasks_cache.get(company_id, [])]
         
         # Add deals
-        company['deals'] = self.data_handler.get_company_deals(company_id)
+        company['deals'] = [dict(deal) for deal in self.deals_cache.get(company_id, [])]
         
         return company
@@ -0,0 +1,268 @@
+import mmap
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import serialization
+from durability import DurableFiles
+
+
+class HistorySegmentStore:
+    """History records in one file of fixed-width records per day, listed in a manifest and sealed with a per-user index"""
+    
+    MANIFEST_NAME = 'manifest.json'
+    RECORD_DTYPE = np.dtype([('user_id', '<i8'), ('timestamp', '<f8'), ('price', '<f8'),
+                             ('message_count', '<i8'), ('spam_penalty', '<f8')])
+    INDEX_DTYPE = np.dtype([('user_id', '<i8'), ('start', '<i8'), ('end', '<i8')])
+    SEAL_DELAY = 3600
+    
+    def __init__(self, directory, files):
+        self.directory = directory
+        self.files = files
+        self.manifest_path = os.path.join(directory, self.MANIFEST_NAME)
+        # Memory-mapped records and user indexes of sealed segments, by day
+        self._maps = {}
+        self._indexes = {}
+        os.makedirs(directory, exist_ok=True)
+        DurableFiles.remove_stale_temp_files(directory)
+        self.segments = self._load_manifest()
+        self._convert_json_segments()
+    
+    def __len__(self):
+        return sum(segment['rows'] for segment in self.segments.values())
+    
+    def _segment_path(self, day):
+        return os.path.join(self.directory, f"{day}.bin")
+    
+    def _index_path(self, day):
+        return os.path.join(self.directory, f"{day}.idx")
+    
+    @staticmethod
+    def _day_bounds(day):
+        start = datetime.fromisoformat(day)
+        return start.timestamp(), (start + timedelta(days=1)).timestamp()
+    
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'rb') as f:
+                segments = serialization.loads(f.read())['segments']
+        except (FileNotFoundError, ValueError, KeyError):
+            return self._rebuild_manifest()
+        for segment in segments.values():
+            segment.setdefault('sealed', False)
+        return segments
+    
+    def _rebuild_manifest(self):
+        """Recreate the manifest from the segment files on disk"""
+        segments = {}
+        for name in sorted(os.listdir(self.directory)):
+            day, extension = os.path.splitext(name)
+            if extension not in ('.bin', '.jsonl'):
+                continue
+            start, end = self._day_bounds(day)
+            rows = 0
+            if extension == '.bin':
+                rows = os.path.getsize(os.path.join(self.directory, name)) // self.RECORD_DTYPE.itemsize
+            segments[day] = {'start': start, 'end': end, 'rows': rows,
+                             'sealed': os.path.exists(self._index_path(day))}
+        if segments:
+            print(f"Rebuilt history manifest from {len(segments)} segments")
+        self.segments = segments
+        self._save_manifest()
+        return segments
+    
+    def _save_manifest(self):
+        self.files.write_atomic(self.manifest_path, serialization.SERIALIZERS['json'].dumps({'segments': self.segments}))
+    
+    def _convert_json_segments(self):
+        """Rewrite segments left as JSON lines in the fixed-width format"""
+        converted = 0
+        for day in sorted(self.segments):
+            json_path = os.path.join(self.directory, f"{day}.jsonl")
+            if not os.path.exists(json_path):
+                continue
+            records = []
+            with open(json_path, 'rb') as f:
+                for line in f:
+                    try:
+                        records.append(serialization.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-append
+                        break
+            self._write_rows(day, self.to_rows(records))
+            self.segments[day].update({'rows': len(records), 'sealed': False})
+            os.remove(json_path)
+            converted += 1
+        if converted:
+            self._save_manifest()
+            print(f"Converted {converted} history segments to fixed-width records")
+    
+    # Conversion between record dicts and packed rows
+    @classmethod
+    def to_rows(cls, records):
+        """Pack history record dicts, which need an ISO recorded_at, as RECORD_DTYPE rows"""
+        return np.array([(record['user_id'],
+                          datetime.fromisoformat(record['recorded_at']).timestamp(),
+                          record.get('stock_value', 10.0),
+                          record.get('message_count', 0),
+                          record.get('spam_penalty', 0))
+                         for record in records], dtype=cls.RECORD_DTYPE)
+    
+    @staticmethod
+    def to_records(rows):
+        """Convert packed rows back to history record dicts"""
+        return [{
+            'user_id': user_id,
+            'stock_value': price,
+            'message_count': message_count,
+            'spam_penalty': spam_penalty,
+            'recorded_at': datetime.fromtimestamp(timestamp).isoformat()
+        } for user_id, timestamp, price, message_count, spam_penalty in rows.tolist()]
+    
+    # Segment files
+    def _rows(self, day):
+        """Get a segment's records, memory-mapped without copying if it is sealed"""
+        if not self.segments[day]['sealed']:
+            data = np.fromfile(self._segment_path(day), dtype=np.uint8)
+            # Ignore a torn final record from a crash mid-append
+            return data[:len(data) - len(data) % self.RECORD_DTYPE.itemsize].view(self.RECORD_DTYPE)
+        
+        if day not in self._maps:
+            with open(self._segment_path(day), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return np.empty(0, dtype=self.RECORD_DTYPE)
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[day] = np.frombuffer(mapped, dtype=self.RECORD_DTYPE)
+        return self._maps[day]
+    
+    def _index(self, day):
+        if day not in self._indexes:
+            self._indexes[day] = np.fromfile(self._index_path(day), dtype=self.INDEX_DTYPE)
+        return self._indexes[day]
+    
+    def _write_rows(self, day, rows):
+        # The map is closed once nothing references it
+        self._maps.pop(day, None)
+        self._indexes.pop(day, None)
+        self.files.write_atomic(self._segment_path(day), rows.tobytes())
+    
+    def _seal(self, day):
+        """Sort a finished day's records by user and write its user index"""
+        rows = np.sort(self._rows(day), order=['user_id', 'timestamp'])
+        self._write_rows(day, rows)
+        
+        user_ids, starts = np.unique(rows['user_id'], return_index=True)
+        index = np.empty(len(user_ids), dtype=self.INDEX_DTYPE)
+        index['user_id'] = user_ids
+        index['start'] = starts
+        index['end'] = np.append(starts[1:], len(rows))
+        self.files.write_atomic(self._index_path(day), index.tobytes())
+        
+        self.segments[day].update({'rows': len(rows), 'sealed': True})
+    
+    def _unseal(self, day):
+        """Make a sealed segment appendable again"""
+        self._maps.pop(day, None)
+        self._indexes.pop(day, None)
+        if os.path.exists(self._index_path(day)):
+            os.remove(self._index_path(day))
+        self.segments[day]['sealed'] = False
+    
+    def seal_finished(self, now):
+        """Seal every segment whose day ended more than SEAL_DELAY before now"""
+        sealed = 0
+        for day, segment in self.segments.items():
+            if not segment['sealed'] and segment['end'] + self.SEAL_DELAY <= now:
+                self._seal(day)
+                sealed += 1
+        if sealed:
+            self._save_manifest()
+        return sealed
+    
+    def append(self, records):
+        """Append records, which need an ISO recorded_at, to their day segments"""
+        by_day = {}
+        for record in records:
+            by_day.setdefault(record['recorded_at'][:10], []).append(record)
+        
+        for day, day_records in by_day.items():
+            if day not in self.segments:
+                start, end = self._day_bounds(day)
+                self.segments[day] = {'start': start, 'end': end, 'rows': 0, 'sealed': False}
+            elif self.segments[day]['sealed']:
+                # A late flush into a day that was already sealed
+                self._unseal(day)
+            with open(self._segment_path(day), 'ab') as f:
+                f.write(self.to_rows(day_records).tobytes())
+                self.files.append(f)
+            self.segments[day]['rows'] += len(day_records)
+        self._save_manifest()
+    
+    def read_rows(self, start=None, end=None, user_id=None):
+        """Get a copy of the packed records with start <= timestamp < end, optionally for one user"""
+        parts = []
+        for day in sorted(self.segments):
+            segment = self.segments[day]
+            if (start is not None and segment['end'] <= start) or (end is not None and segment['start'] >= end):
+                continue
+            
+            rows = self._rows(day)
+            if user_id is not None and segment['sealed']:
+                # Sealed segments hold each user's records together, in time order
+                index = self._index(day)
+                position = np.searchsorted(index['user_id'], user_id)
+                if position == len(index) or index['user_id'][position] != user_id:
+                    continue
+                rows = rows[index['start'][position]:index['end'][position]]
+                first = 0 if start is None else np.searchsorted(rows['timestamp'], start, side='left')
+                last = len(rows) if end is None else np.searchsorted(rows['timestamp'], end, side='left')
+                parts.append(rows[first:last])
+                continue
+            
+            mask = np.ones(len(rows), dtype=bool)
+            if user_id is not None:
+                mask &= rows['user_id'] == user_id
+            # Only segments that straddle the window need their rows checked
+            if start is not None and segment['start'] < start:
+                mask &= rows['timestamp'] >= start
+            if end is not None and segment['end'] > end:
+                mask &= rows['timestamp'] < end
+            parts.append(rows if mask.all() else rows[mask])
+        
+        # Concatenating copies the records out of the memory maps
+        if not parts:
+            return np.empty(0, dtype=self.RECORD_DTYPE)
+        return np.concatenate(parts)
+    
+    def read_range(self, start=None, end=None):
+        """Get the records with start <= recorded_at < end, oldest segment first"""
+        return self.to_records(self.read_rows(start, end))
+    
+    def prune(self, cutoff):
+        """Drop records from before cutoff and return how many were removed"""
+        # Segments that ended before cutoff are deleted outright; the one that
+        # straddles it is compacted down to its newer records
+        removed = 0
+        for day in sorted(self.segments):
+            segment = self.segments[day]
+            if segment['start'] >= cutoff:
+                break
+            
+            if segment['end'] <= cutoff:
+                self._unseal(day)
+                os.remove(self._segment_path(day))
+                removed += segment['rows']
+                del self.segments[day]
+                continue
+            
+            rows = self._rows(day)
+            kept = rows[rows['timestamp'] >= cutoff]
+            if len(kept) < len(rows):
+                removed += len(rows) - len(kept)
+                self._write_rows(day, kept)
+                segment['rows'] = len(kept)
+                if segment['sealed']:
+                    self._seal(day)
+        
+        if removed:
+            self._save_manifest()
+        return removed
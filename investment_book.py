@@ -0,0 +1,112 @@
+import time
+
+
+class InvestmentBook:
+    """Open investment positions, indexed by investor and by subject, with changes tracked for the sync"""
+    
+    def __init__(self):
+        self.positions = {}
+        self.by_investor = {}
+        self.by_subject = {}
+        self.next_id = 1
+        self.dirty_keys = set()
+        self.removed_ids = set()
+    
+    def load(self, investments):
+        """Rebuild the book from stored investment rows"""
+        self.positions = {}
+        self.by_investor = {}
+        self.by_subject = {}
+        self.dirty_keys = set()
+        self.removed_ids = set()
+        self.next_id = max([inv.get('id', 0) for inv in investments] + [0]) + 1
+        
+        for investment in investments:
+            key = (investment.get('investor_id'), investment.get('subject_id'))
+            if key in self.positions:
+                # Merge duplicate rows left behind by older versions
+                self.positions[key]['shares_owned'] += investment.get('shares_owned', 0)
+                self.removed_ids.add(investment['id'])
+                self.dirty_keys.add(key)
+                continue
+            self._index(key, investment)
+    
+    def _index(self, key, investment):
+        investor_id, subject_id = key
+        self.positions[key] = investment
+        self.by_investor.setdefault(investor_id, set()).add(subject_id)
+        self.by_subject.setdefault(subject_id, set()).add(investor_id)
+    
+    def _unindex(self, key):
+        investor_id, subject_id = key
+        investment = self.positions.pop(key)
+        self.by_investor[investor_id].discard(subject_id)
+        if not self.by_investor[investor_id]:
+            del self.by_investor[investor_id]
+        self.by_subject[subject_id].discard(investor_id)
+        if not self.by_subject[subject_id]:
+            del self.by_subject[subject_id]
+        return investment
+    
+    def get(self, investor_id, subject_id):
+        """Get a copy of one position, or None"""
+        investment = self.positions.get((investor_id, subject_id))
+        return investment.copy() if investment else None
+    
+    def get_investor_positions(self, investor_id):
+        """Get copies of every position held by an investor"""
+        return [self.positions[(investor_id, subject_id)].copy()
+                for subject_id in self.by_investor.get(investor_id, ())]
+    
+    def get_investor_count(self, subject_id):
+        """Number of users holding shares of a subject"""
+        return len(self.by_subject.get(subject_id, ()))
+    
+    def buy(self, investor_id, subject_id, shares, price):
+        """Add shares to a position, opening it if needed"""
+        key = (investor_id, subject_id)
+        investment = self.positions.get(key)
+        if investment:
+            investment['shares_owned'] += shares
+            investment['purchase_price'] = price
+        else:
+            investment = {
+                'id': self.next_id,
+                'investor_id': investor_id,
+                'subject_id': subject_id,
+                'shares_owned': shares,
+                'purchase_price': price,
+                'invested_at': time.time()
+            }
+            self.next_id += 1
+            self._index(key, investment)
+        self.dirty_keys.add(key)
+        return investment.copy()
+    
+    def sell(self, investor_id, subject_id, shares):
+        """Remove shares from a position, closing it when none are left"""
+        key = (investor_id, subject_id)
+        investment = self.positions[key]
+        investment['shares_owned'] -= shares
+        if investment['shares_owned'] <= 0:
+            self._unindex(key)
+            self.removed_ids.add(investment['id'])
+            self.dirty_keys.discard(key)
+        else:
+            self.dirty_keys.add(key)
+    
+    def take_changes(self):
+        """Drain pending changes as (changed rows, removed row ids)"""
+        changed = [self.positions[key].copy() for key in self.dirty_keys]
+        removed = list(self.removed_ids)
+        self.dirty_keys = set()
+        self.removed_ids = set()
+        return changed, removed
+    
+    def restore_changes(self, changed, removed):
+        """Mark changes as pending again after a failed write"""
+        for investment in changed:
+            key = (investment['investor_id'], investment['subject_id'])
+            if key in self.positions:
+                self.dirty_keys.add(key)
+        self.removed_ids.update(removed)
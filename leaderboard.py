@@ -0,0 +1,112 @@
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """Users ordered by stock value, highest first, in sorted chunks with a Fenwick tree of chunk sizes for ranks"""
+    
+    CHUNK_SIZE = 512
+    
+    def __init__(self):
+        self.chunks = []
+        self.chunk_maxes = []
+        self.chunk_counts = [0]
+        self.keys = {}
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def load(self, stock_values):
+        """Rebuild the leaderboard from a {user_id: stock_value} mapping"""
+        self.keys = {user_id: (-value, user_id) for user_id, value in stock_values.items()}
+        ordered = sorted(self.keys.values())
+        self.chunks = [ordered[i:i + self.CHUNK_SIZE] for i in range(0, len(ordered), self.CHUNK_SIZE)]
+        self.chunk_maxes = [chunk[-1] for chunk in self.chunks]
+        self._rebuild_counts()
+    
+    def update(self, user_id, stock_value):
+        """Insert a user or move them to their new position"""
+        key = (-stock_value, user_id)
+        old_key = self.keys.get(user_id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._remove_key(old_key)
+        self._insert_key(key)
+        self.keys[user_id] = key
+    
+    def remove(self, user_id):
+        key = self.keys.pop(user_id, None)
+        if key is not None:
+            self._remove_key(key)
+    
+    # Fenwick tree over chunk sizes, rebuilt only when chunks split or vanish
+    def _rebuild_counts(self):
+        self.chunk_counts = [0] * (len(self.chunks) + 1)
+        for index, chunk in enumerate(self.chunks, 1):
+            self.chunk_counts[index] += len(chunk)
+            parent = index + (index & -index)
+            if parent < len(self.chunk_counts):
+                self.chunk_counts[parent] += self.chunk_counts[index]
+    
+    def _add_count(self, index, delta):
+        index += 1
+        while index < len(self.chunk_counts):
+            self.chunk_counts[index] += delta
+            index += index & -index
+    
+    def _count_before(self, index):
+        total = 0
+        while index > 0:
+            total += self.chunk_counts[index]
+            index -= index & -index
+        return total
+    
+    def _insert_key(self, key):
+        if not self.chunks:
+            self.chunks.append([key])
+            self.chunk_maxes.append(key)
+            self._rebuild_counts()
+            return
+        
+        index = min(bisect_left(self.chunk_maxes, key), len(self.chunks) - 1)
+        chunk = self.chunks[index]
+        insort(chunk, key)
+        self.chunk_maxes[index] = chunk[-1]
+        
+        # Split chunks that grow too large so inserts stay cheap
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            self.chunks[index:index + 1] = [chunk[:self.CHUNK_SIZE], chunk[self.CHUNK_SIZE:]]
+            self.chunk_maxes[index:index + 1] = [chunk[self.CHUNK_SIZE - 1], chunk[-1]]
+            self._rebuild_counts()
+        else:
+            self._add_count(index, 1)
+    
+    def _remove_key(self, key):
+        index = bisect_left(self.chunk_maxes, key)
+        chunk = self.chunks[index]
+        del chunk[bisect_left(chunk, key)]
+        if chunk:
+            self.chunk_maxes[index] = chunk[-1]
+            self._add_count(index, -1)
+        else:
+            del self.chunks[index]
+            del self.chunk_maxes[index]
+            self._rebuild_counts()
+    
+    def top(self, limit):
+        """Get the top (user_id, stock_value) pairs"""
+        leaders = []
+        for chunk in self.chunks:
+            for value, user_id in chunk:
+                if len(leaders) >= limit:
+                    return leaders
+                leaders.append((user_id, -value))
+        return leaders
+    
+    def rank(self, user_id):
+        """Get a user's 1-based rank, or None if they aren't ranked"""
+        key = self.keys.get(user_id)
+        if key is None:
+            return None
+        index = bisect_left(self.chunk_maxes, key)
+        return self._count_before(index) + bisect_left(self.chunks[index], key) + 1
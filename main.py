@@ -4,6 +4,7 @@ from discord.ext import commands
 import asyncio
 import config
 from economy import EconomySystem
+from activity_pipeline import ActivityPipeline
 import commands as bot_commands
 import threading
 import time
@@ -13,8 +14,12 @@ intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix=config.BOT_PREFIX, intents=intents)
 
+# Fork the chart workers while this is still the only thread
+bot_commands.chart_renderer.start()
+
 # Setup economy system
 economy = EconomySystem()
+activity_pipeline = ActivityPipeline(economy)
 
 # Background task to sync data to storage
 async def sync_data_periodically():
@@ -23,7 +28,19 @@ async def sync_data_periodically():
     
     while not bot.is_closed():
         try:
-            economy.sync_to_storage()
+            # The sync writes to disk, so run it off the event loop
+            stats = await asyncio.get_running_loop().run_in_executor(None, economy.sync_to_storage)
+            if stats['users'] or stats['companies']:
+                print(f"Wrote {stats['users']} users, {stats['companies']} companies")
+            if stats['history_rows']:
+                print(f"Flushed {stats['history_rows']} history rows in {stats['history_seconds'] * 1000:.1f} ms")
+            if stats['candles'] or stats['pruned_rows']:
+                print(f"Wrote {stats['candles']} candles, pruned {stats['pruned_rows']} raw history rows")
+            
+            pipeline_stats = activity_pipeline.get_stats()
+            print(f"Activity pipeline: {pipeline_stats['processed']} processed, {pipeline_stats['depth']} queued, "
+                  f"{pipeline_stats['dropped']} dropped, {pipeline_stats['coalesced']} coalesced, "
+                  f"max depth {pipeline_stats['max_depth']}")
             await asyncio.sleep(config.CACHE_SYNC_INTERVAL)
         except Exception as e:
             print(f"Error in sync_data_periodically: {e}")
@@ -48,7 +65,8 @@ async def on_ready():
     except Exception as e:
         print(f"Failed to sync commands: {e}")
     
-    # Start the background task
+    # Start the activity workers and the background task
+    activity_pipeline.start()
     bot.loop.create_task(sync_data_periodically())
 
 # Event: Message handler with anti-spam
@@ -57,11 +75,8 @@ async def on_message(message):
     if message.author.bot:
         return
         
-    try:
-        # Update user activity with anti-spam check
-        economy.update_user_activity(message.author.id, message.content)
-    except Exception as e:
-        print(f"Error updating user activity: {e}")
+    # Queue the activity update; the workers apply the anti-spam checks
+    activity_pipeline.submit(message.author.id, message.content)
     
     # Process commands
     await bot.process_commands(message)
@@ -108,9 +123,14 @@ async def profile(interaction: discord.Interaction, member: discord.Member = Non
     await bot_commands.profile(interaction, economy, member)
 
 @bot.tree.command(name="chart", description="View stock performance chart for a user")
-@app_commands.describe(member="The user to view (default: yourself)", days="Number of days to show (1-30)")
-async def chart(interaction: discord.Interaction, member: discord.Member = None, days: int = 7):
-    await bot_commands.chart(interaction, economy, member, days)
+@app_commands.describe(member="The user to view (default: yourself)", days="Number of days to show (1-30)",
+                       style="Line chart or OHLC candlesticks")
+@app_commands.choices(style=[
+    app_commands.Choice(name="Line", value="line"),
+    app_commands.Choice(name="Candlestick", value="candle")
+])
+async def chart(interaction: discord.Interaction, member: discord.Member = None, days: int = 7, style: str = 'line'):
+    await bot_commands.chart(interaction, economy, member, days, style)
 
 # New company commands
 @bot.tree.command(name="create_company", description="Create a new company")
@@ -153,6 +173,10 @@ async def accept_deal(interaction: discord.Interaction, deal_id: int):
 async def company_info(interaction: discord.Interaction, company_id: int = None):
     await bot_commands.company_info(interaction, economy, company_id)
 
+@bot.tree.command(name="payroll_preview", description="Preview your company's next payroll run")
+async def payroll_preview(interaction: discord.Interaction):
+    await bot_commands.payroll_preview(interaction, economy)
+
 # Run the bot
 if __name__ == "__main__":
     bot.run(config.DISCORD_TOKEN)
@@ -0,0 +1,52 @@
+class MembershipIndex:
+    """Each user's employee record and each company's members, with role permissions as bitmasks"""
+    
+    def __init__(self, role_permissions):
+        permissions = sorted({permission for granted in role_permissions.values() for permission in granted})
+        self.permission_bits = {permission: 1 << bit for bit, permission in enumerate(permissions)}
+        self.role_masks = {role: sum(self.permission_bits[permission] for permission in set(granted))
+                           for role, granted in role_permissions.items()}
+        # user_id -> employee record, in stored order for payroll
+        self.employees = {}
+        # company_id -> {user_id: employee record}, in hiring order
+        self.members = {}
+    
+    def __len__(self):
+        return len(self.employees)
+    
+    def load(self, employees):
+        """Rebuild the index from {str(user_id): employee} records as stored"""
+        self.employees = {}
+        self.members = {}
+        for employee in employees.values():
+            self.add(employee)
+    
+    def add(self, employee):
+        """Add or replace a user's employee record"""
+        user_id = int(employee['user_id'])
+        self.remove(user_id)
+        if not employee.get('company_id'):
+            return
+        self.employees[user_id] = employee
+        self.members.setdefault(employee['company_id'], {})[user_id] = employee
+    
+    def remove(self, user_id):
+        employee = self.employees.pop(user_id, None)
+        if employee is None:
+            return
+        members = self.members[employee['company_id']]
+        del members[user_id]
+        if not members:
+            del self.members[employee['company_id']]
+    
+    def get(self, user_id):
+        """A user's employee record, or None if they aren't employed"""
+        return self.employees.get(user_id)
+    
+    def company_members(self, company_id):
+        """A company's {user_id: employee} records"""
+        return self.members.get(company_id, {})
+    
+    def role_allows(self, role, permission):
+        """Whether a role has a permission, e.g. 'hire'. Roles not in ROLE_PERMISSIONS have none."""
+        return bool(self.role_masks.get(role, 0) & self.permission_bits[permission])
@@ -0,0 +1,55 @@
+"""Convert the data snapshots between the JSON and binary formats, or import them into SQLite"""
+import argparse
+import os
+import config
+import serialization
+
+
+def snapshot_files():
+    return [config.USERS_FILE, config.INVESTMENTS_FILE, config.TRANSACTIONS_FILE, config.SPAM_TRACKER_FILE,
+            config.COMPANIES_FILE, config.EMPLOYEES_FILE, config.TASKS_FILE, config.DEALS_FILE,
+            config.COUNTERS_FILE, config.CANDLES_FILE]
+
+
+def migrate(format_name):
+    """Convert every snapshot to the given format and return how many were converted"""
+    # Append-only logs and history segments are the same in both formats
+    converted = 0
+    for file_path in snapshot_files():
+        target_path = serialization.snapshot_path(file_path, format_name)
+        if serialization.convert_snapshot(file_path, format_name):
+            print(f"Converted {os.path.basename(target_path)} ({os.path.getsize(target_path):,} bytes)")
+            converted += 1
+        elif os.path.exists(target_path):
+            print(f"{os.path.basename(target_path)} is already in the {format_name} format")
+    return converted
+
+
+def import_to_sqlite():
+    """Import the data files into DATABASE_PATH unless they already have been"""
+    from database import SQLiteDataHandler
+    handler = SQLiteDataHandler()
+    print(f"{config.DATABASE_PATH} holds {len(handler.get_all_users())} users")
+    handler.close()
+    if config.STORAGE_BACKEND != 'sqlite':
+        print("Set STORAGE_BACKEND = 'sqlite' in config.py before starting the bot")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert data snapshots between the JSON and binary formats, "
+                                                 "or import them into SQLite")
+    parser.add_argument('format', choices=list(serialization.SERIALIZERS) + ['sqlite'], help="Format to convert to")
+    args = parser.parse_args()
+    
+    if args.format == 'sqlite':
+        import_to_sqlite()
+        return
+    
+    converted = migrate(args.format)
+    print(f"Converted {converted} snapshots to the {args.format} format")
+    if args.format != config.SNAPSHOT_FORMAT:
+        print(f"Set SNAPSHOT_FORMAT = '{args.format}' in config.py before starting the bot")
+
+
+if __name__ == '__main__':
+    main()
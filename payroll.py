@@ -0,0 +1,110 @@
+import heapq
+import time
+import zlib
+import numpy as np
+
+
+def plan_payroll(employees, companies, company_id=None):
+    """Plan one payroll run for {int user_id: employee} records without applying it, as (user_id, company_id, salary) payments"""
+    started = time.perf_counter()
+    rows = []
+    for user_id, employee in employees.items():
+        employer_id = employee.get('company_id')
+        salary = employee.get('salary', 0)
+        if employer_id in companies and salary > 0 and company_id in (None, employer_id):
+            rows.append((int(user_id), employer_id, float(salary)))
+    
+    plan = {'payments': [], 'skipped': [], 'credits': {}, 'debits': {}, 'total': 0.0}
+    if rows:
+        # Sum each company's payroll at once, then only walk the employees
+        # of companies that can't cover all of it
+        company_ids = list(dict.fromkeys(row[1] for row in rows))
+        company_index = {employer_id: index for index, employer_id in enumerate(company_ids)}
+        employer = np.array([company_index[row[1]] for row in rows])
+        salaries = np.array([row[2] for row in rows])
+        funds = np.array([companies[employer_id].get('funds', 0) for employer_id in company_ids], dtype=np.float64)
+        
+        totals = np.bincount(employer, weights=salaries, minlength=len(company_ids))
+        paid = (totals <= funds)[employer]
+        short = totals > funds
+        # Companies that can't cover all of it pay employees in stored order
+        # while funds last, skipping anyone whose salary is more than what's left
+        if short.any():
+            # Stable, so each company's employees stay in stored order
+            order = np.argsort(employer, kind='stable')
+            bounds = np.searchsorted(employer[order], np.arange(len(company_ids) + 1))
+        for index in np.flatnonzero(short):
+            remaining = funds[index]
+            for row in order[bounds[index]:bounds[index + 1]]:
+                if salaries[row] <= remaining:
+                    remaining -= salaries[row]
+                    paid[row] = True
+        
+        debits = np.bincount(employer, weights=np.where(paid, salaries, 0), minlength=len(company_ids))
+        plan['debits'] = {employer_id: float(debit) for employer_id, debit in zip(company_ids, debits) if debit}
+        for row, is_paid in zip(rows, paid.tolist()):
+            if is_paid:
+                plan['payments'].append(row)
+                plan['credits'][row[0]] = plan['credits'].get(row[0], 0) + row[2]
+            else:
+                plan['skipped'].append(row)
+        plan['total'] = float(debits.sum())
+    
+    plan['seconds'] = time.perf_counter() - started
+    return plan
+
+
+class PayrollSchedule:
+    """Heap of when each company's next payroll cycle is due, offset into the interval by a hash of its id"""
+    
+    def __init__(self, interval):
+        self.interval = int(interval)
+        # (due time, company_id), with entries for paid cycles left in
+        # place and skipped when they come up
+        self.heap = []
+    
+    def offset(self, company_id):
+        return zlib.crc32(str(company_id).encode()) % self.interval
+    
+    def due_at(self, company_id, cycle):
+        """When a company's payroll for a cycle is due"""
+        return cycle * self.interval + self.offset(company_id)
+    
+    def latest_cycle(self, company_id, timestamp):
+        """The company's most recent cycle due at or before timestamp"""
+        return int((timestamp - self.offset(company_id)) // self.interval)
+    
+    def _start(self, company_id, company, now):
+        """Give a company its first cycle after now if it hasn't got one. Returns True if it was added."""
+        if 'payroll_cycle' in company:
+            return False
+        company['payroll_cycle'] = self.latest_cycle(company_id, now) + 1
+        return True
+    
+    def load(self, companies, now):
+        """Schedule every company, returning the ids of those that were given their first cycle"""
+        started = [company_id for company_id, company in companies.items() if self._start(company_id, company, now)]
+        self.heap = [(self.due_at(company_id, company['payroll_cycle']), company_id)
+                     for company_id, company in companies.items()]
+        heapq.heapify(self.heap)
+        return started
+    
+    def add(self, company_id, company, now):
+        """Schedule a company's next cycle. Returns True if it was given its first cycle."""
+        started = self._start(company_id, company, now)
+        heapq.heappush(self.heap, (self.due_at(company_id, company['payroll_cycle']), company_id))
+        return started
+    
+    def next_due(self, company_id, company):
+        return self.due_at(company_id, company['payroll_cycle']) if 'payroll_cycle' in company else None
+    
+    def pop_due(self, companies, now):
+        """Take the ids of companies with a payroll due by now off the heap"""
+        due = {}
+        while self.heap and self.heap[0][0] <= now:
+            due_at, company_id = heapq.heappop(self.heap)
+            company = companies.get(company_id)
+            # Entries for removed companies and already paid cycles are stale
+            if company is not None and self.next_due(company_id, company) == due_at:
+                due[company_id] = due_at
+        return list(due)
@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class PriceSeries:
+    """Price history for one user as growable NumPy columns, sorted by timestamp"""
+    
+    INITIAL_CAPACITY = 16
+    
+    def __init__(self, timestamps=None, prices=None, message_counts=None):
+        if timestamps is None:
+            self.timestamps = np.empty(self.INITIAL_CAPACITY, dtype=np.float64)
+            self.prices = np.empty(self.INITIAL_CAPACITY, dtype=np.float32)
+            self.message_counts = np.empty(self.INITIAL_CAPACITY, dtype=np.int32)
+            self.size = 0
+        else:
+            self.timestamps = np.asarray(timestamps, dtype=np.float64)
+            self.prices = np.asarray(prices, dtype=np.float32)
+            self.message_counts = np.asarray(message_counts, dtype=np.int32)
+            self.size = len(self.timestamps)
+        # Named window -> (cutoff, index of its first point), moved forward as
+        # time passes so looking a window up again is amortized O(1)
+        self.cursors = {}
+    
+    def __len__(self):
+        return self.size
+    
+    def _grow(self):
+        capacity = max(self.INITIAL_CAPACITY, len(self.timestamps) * 2)
+        for name in ('timestamps', 'prices', 'message_counts'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+    
+    def append(self, timestamp, price, message_count):
+        """Add a point, keeping the series sorted by timestamp"""
+        if self.size == len(self.timestamps):
+            self._grow()
+        
+        index = self.size
+        if self.size and timestamp < self.timestamps[self.size - 1]:
+            # Out-of-order point, shift the newer ones up to make room
+            index = int(np.searchsorted(self.timestamps[:self.size], timestamp, side='right'))
+            for column in (self.timestamps, self.prices, self.message_counts):
+                column[index + 1:self.size + 1] = column[index:self.size]
+            self.cursors = {}
+        
+        self.timestamps[index] = timestamp
+        self.prices[index] = price
+        self.message_counts[index] = message_count
+        self.size += 1
+    
+    def prepend(self, older):
+        """Put another series, whose points are all older, in front of this one"""
+        for name in ('timestamps', 'prices', 'message_counts'):
+            setattr(self, name, np.concatenate((getattr(older, name)[:older.size], getattr(self, name)[:self.size])))
+        self.size += older.size
+        self.cursors = {}
+    
+    def prune(self, cutoff):
+        """Drop points from before cutoff. Returns how many were dropped."""
+        count = int(np.searchsorted(self.timestamps[:self.size], cutoff, side='left'))
+        if not count:
+            return 0
+        # Copy what's left so the dropped points' memory is freed
+        for name in ('timestamps', 'prices', 'message_counts'):
+            setattr(self, name, getattr(self, name)[count:self.size].copy())
+        self.size -= count
+        self.cursors = {window: (window_cutoff, max(0, index - count))
+                        for window, (window_cutoff, index) in self.cursors.items()}
+        return count
+    
+    def first_index(self, cutoff, window=None):
+        """Index of the first point at or after cutoff, using the named window's cursor if given"""
+        cursor = self.cursors.get(window) if window is not None else None
+        if cursor is None or cutoff < cursor[0]:
+            index = int(np.searchsorted(self.timestamps[:self.size], cutoff, side='left'))
+        else:
+            index = cursor[1]
+            while index < self.size and self.timestamps[index] < cutoff:
+                index += 1
+        
+        if window is not None:
+            self.cursors[window] = (cutoff, index)
+        return index
+    
+    def window(self, start, end=None, window=None):
+        """Get (timestamps, prices, message_counts) views for start <= timestamp < end"""
+        timestamps = self.timestamps[:self.size]
+        first = self.first_index(start, window)
+        last = self.size if end is None else int(np.searchsorted(timestamps, end, side='left'))
+        return (timestamps[first:last],
+                self.prices[first:last],
+                self.message_counts[first:last])
+    
+    def last_timestamp(self):
+        return float(self.timestamps[self.size - 1]) if self.size else None
+
+
+class PriceHistoryStore:
+    """Columnar price history for every user, keyed by user_id"""
+    
+    def __init__(self):
+        self.series = {}
+    
+    def __contains__(self, user_id):
+        return user_id in self.series
+    
+    def get(self, user_id):
+        return self.series.get(user_id)
+    
+    def append(self, user_id, timestamp, price, message_count):
+        if user_id not in self.series:
+            self.series[user_id] = PriceSeries()
+        self.series[user_id].append(timestamp, price, message_count)
+    
+    def prepend(self, older):
+        """Merge in another store whose points all predate the ones here"""
+        for user_id, series in older.series.items():
+            if user_id in self.series:
+                self.series[user_id].prepend(series)
+            else:
+                self.series[user_id] = series
+    
+    def prune(self, cutoff):
+        """Drop every user's points from before cutoff. Returns how many were dropped."""
+        dropped = 0
+        for user_id, series in list(self.series.items()):
+            dropped += series.prune(cutoff)
+            if not len(series):
+                del self.series[user_id]
+        return dropped
+    
+    def load(self, user_ids, timestamps, prices, message_counts):
+        """Replace the store with the given points, which may be in any order"""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float32)
+        message_counts = np.asarray(message_counts, dtype=np.int32)
+        
+        # Sort by user, then by time, and split into one series per user
+        order = np.lexsort((timestamps, user_ids))
+        user_ids = user_ids[order]
+        boundaries = np.flatnonzero(np.diff(user_ids)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(user_ids)]))
+        
+        self.series = {}
+        for start, end in zip(starts, ends):
+            if start == end:
+                continue
+            selection = order[start:end]
+            self.series[int(user_ids[start])] = PriceSeries(
+                timestamps[selection],
+                prices[selection],
+                message_counts[selection]
+            )
+    
+    def window(self, user_id, start, end=None, window=None):
+        """Get (timestamps, prices, message_counts) for one user, empty if unknown"""
+        series = self.series.get(user_id)
+        if series is None:
+            empty = np.empty(0)
+            return empty, empty.astype(np.float32), empty.astype(np.int32)
+        return series.window(start, end, window)
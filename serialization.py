@@ -0,0 +1,219 @@
+import json
+import os
+import struct
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Parse JSON text or bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JSONSerializer:
+    """Pretty-printed JSON snapshots, easy to read and edit by hand"""
+    
+    extension = '.json'
+    
+    def dumps(self, data, default=None):
+        return json.dumps(data, indent=2, default=default).encode('utf-8')
+    
+    def loads(self, data):
+        return loads(data)
+
+
+# Binary snapshots store collections of records (a dict of dicts, like users,
+# or a list of dicts, like investments) column by column: integers as int64
+# arrays, other numbers as float64 arrays, strings as one NUL-separated UTF-8
+# blob. Fields some records lack get a presence mask, and a column that fits
+# none of those is a JSON array. Anything else is a single JSON document.
+class BinarySerializer:
+    """Compact struct-packed snapshots with one column per record field"""
+    
+    extension = '.bin'
+    MAGIC = b'ECON\x01'
+    
+    # Snapshot kinds
+    RECORD_DICT = b'd'
+    RECORD_LIST = b'l'
+    DOCUMENT = b'j'
+    
+    # Column types
+    INT = b'i'
+    FLOAT = b'f'
+    NUMBER = b'n'
+    STRING = b's'
+    JSON = b'j'
+    
+    INT64_MIN = -2 ** 63
+    INT64_MAX = 2 ** 63 - 1
+    
+    def dumps(self, data, default=None):
+        if (isinstance(data, dict) and data and all(isinstance(value, dict) for value in data.values()) and
+                not any('\x00' in str(key) for key in data)):
+            return self.MAGIC + self.RECORD_DICT + self._pack_records(list(data.values()), list(data), default)
+        if isinstance(data, list) and data and all(isinstance(value, dict) for value in data):
+            return self.MAGIC + self.RECORD_LIST + self._pack_records(data, None, default)
+        return self.MAGIC + self.DOCUMENT + json.dumps(data, separators=(',', ':'), default=default).encode('utf-8')
+    
+    def loads(self, data):
+        data = memoryview(data)
+        if bytes(data[:len(self.MAGIC)]) != self.MAGIC:
+            raise ValueError("Not a binary snapshot")
+        kind = bytes(data[len(self.MAGIC):len(self.MAGIC) + 1])
+        body = data[len(self.MAGIC) + 1:]
+        if kind == self.DOCUMENT:
+            return loads(bytes(body))
+        
+        try:
+            records, keys = self._unpack_records(body)
+        except struct.error as e:
+            raise ValueError(f"Truncated binary snapshot: {e}")
+        if kind == self.RECORD_DICT:
+            return dict(zip(keys, records))
+        return records
+    
+    # Record collections
+    def _column_type(self, values):
+        if all(type(value) is int and self.INT64_MIN <= value <= self.INT64_MAX for value in values):
+            return self.INT
+        if all(type(value) is float for value in values):
+            return self.FLOAT
+        if all(type(value) in (int, float) and abs(value) < 2 ** 53 for value in values):
+            return self.NUMBER
+        if all(type(value) is str and '\x00' not in value for value in values):
+            return self.STRING
+        return self.JSON
+    
+    def _pack_strings(self, values):
+        return '\x00'.join(values).encode('utf-8')
+    
+    def _unpack_strings(self, blob, count):
+        return bytes(blob).decode('utf-8').split('\x00') if count else []
+    
+    def _pack_records(self, records, keys, default):
+        fields = list(dict.fromkeys(field for record in records for field in record))
+        chunks = [struct.pack('<IH?', len(records), len(fields), keys is not None)]
+        if keys is not None:
+            chunks.append(self._pack_strings([str(key) for key in keys]))
+        
+        for field in fields:
+            present = [field in record for record in records]
+            values = [record[field] for record in records if field in record]
+            column_type = self._column_type(values)
+            name = field.encode('utf-8')
+            chunks.append(struct.pack('<H', len(name)) + name + column_type + struct.pack('<?', not all(present)))
+            if not all(present):
+                chunks.append(np.array(present, dtype=np.bool_).tobytes())
+            
+            if column_type == self.INT:
+                chunks.append(np.array(values, dtype='<i8').tobytes())
+            elif column_type == self.FLOAT:
+                chunks.append(np.array(values, dtype='<f8').tobytes())
+            elif column_type == self.NUMBER:
+                chunks.append(np.array(values, dtype='<f8').tobytes())
+                chunks.append(np.array([type(value) is int for value in values], dtype=np.bool_).tobytes())
+            elif column_type == self.STRING:
+                chunks.append(self._pack_strings(values))
+            else:
+                chunks.append(json.dumps(values, separators=(',', ':'), default=default).encode('utf-8'))
+        
+        # Length-prefix every chunk after the header so columns can be sliced out
+        return chunks[0] + b''.join(struct.pack('<Q', len(chunk)) + chunk for chunk in chunks[1:])
+    
+    def _unpack_records(self, body):
+        count, field_count, has_keys = struct.unpack_from('<IH?', body)
+        position = struct.calcsize('<IH?')
+        
+        def next_chunk():
+            nonlocal position
+            (size,) = struct.unpack_from('<Q', body, position)
+            position += 8 + size
+            return body[position - size:position]
+        
+        keys = self._unpack_strings(next_chunk(), count) if has_keys else None
+        
+        fields = []
+        columns = []
+        masked_columns = []
+        for _ in range(field_count):
+            header = next_chunk()
+            (name_length,) = struct.unpack_from('<H', header)
+            field = bytes(header[2:2 + name_length]).decode('utf-8')
+            column_type = bytes(header[2 + name_length:3 + name_length])
+            (masked,) = struct.unpack_from('<?', header, 3 + name_length)
+            present = np.frombuffer(next_chunk(), dtype=np.bool_) if masked else None
+            size = count if present is None else int(present.sum())
+            
+            if column_type == self.INT:
+                values = np.frombuffer(next_chunk(), dtype='<i8').tolist()
+            elif column_type == self.FLOAT:
+                values = np.frombuffer(next_chunk(), dtype='<f8').tolist()
+            elif column_type == self.NUMBER:
+                numbers = np.frombuffer(next_chunk(), dtype='<f8').tolist()
+                is_int = np.frombuffer(next_chunk(), dtype=np.bool_).tolist()
+                values = [int(value) if integer else value for value, integer in zip(numbers, is_int)]
+            elif column_type == self.STRING:
+                values = self._unpack_strings(next_chunk(), size)
+            else:
+                values = loads(bytes(next_chunk()))
+            
+            if present is None:
+                fields.append(field)
+                columns.append(values)
+            else:
+                masked_columns.append((field, np.flatnonzero(present).tolist(), values))
+        
+        # Build the records row by row from the complete columns, then fill
+        # in the fields only some records have
+        records = [dict(zip(fields, row)) for row in zip(*columns)] if columns else [{} for _ in range(count)]
+        for field, indices, values in masked_columns:
+            for index, value in zip(indices, values):
+                records[index][field] = value
+        
+        return records, keys
+
+
+SERIALIZERS = {
+    'json': JSONSerializer(),
+    'binary': BinarySerializer()
+}
+
+
+def get_serializer(name):
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown snapshot format '{name}', expected one of {', '.join(SERIALIZERS)}")
+    return SERIALIZERS[name]
+
+
+def snapshot_path(file_path, format_name):
+    """Path of a collection's snapshot in the given format"""
+    return os.path.splitext(file_path)[0] + get_serializer(format_name).extension
+
+
+def convert_snapshot(file_path, format_name):
+    """Rewrite a collection's snapshot in another format into the given one. Returns True if one was converted."""
+    target_path = snapshot_path(file_path, format_name)
+    if os.path.exists(target_path):
+        return False
+    
+    for source_name, source in SERIALIZERS.items():
+        source_path = snapshot_path(file_path, source_name)
+        if source_path == target_path or not os.path.exists(source_path):
+            continue
+        with open(source_path, 'rb') as f:
+            data = source.loads(f.read())
+        with open(target_path + '.tmp', 'wb') as f:
+            f.write(get_serializer(format_name).dumps(data))
+        os.replace(target_path + '.tmp', target_path)
+        # Kept rather than deleted, but renamed so it isn't converted back if
+        # the format is switched back
+        os.replace(source_path, source_path + '.converted')
+        return True
+    return False
@@ -0,0 +1,255 @@
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+import config
+from history_segments import HistorySegmentStore
+
+
+class StorageBackend(ABC):
+    """Interface every storage engine implements, safe to call from any thread"""
+    
+    # Dict collections (users, spam data, companies, employees, tasks, deals,
+    # candles) read back as {str(key): record}, list collections (investments,
+    # transactions) as lists of records carrying an 'id'
+    
+    # Maintenance
+    def compact(self):
+        """Fold any write-ahead state into the main store"""
+    
+    def commit_writes(self):
+        """Force writes still waiting on the durability policy to disk. Returns the seconds spent."""
+        return 0.0
+    
+    # Users
+    @abstractmethod
+    def get_all_users(self):
+        pass
+    
+    @abstractmethod
+    def get_user(self, user_id):
+        pass
+    
+    @abstractmethod
+    def save_user(self, user_data):
+        pass
+    
+    @abstractmethod
+    def save_all_users(self, users_data):
+        pass
+    
+    @abstractmethod
+    def save_users(self, users_data):
+        """Save {str(user_id): user} records, leaving other users alone"""
+    
+    # Investments
+    @abstractmethod
+    def get_all_investments(self):
+        pass
+    
+    @abstractmethod
+    def save_investment(self, investment_data):
+        pass
+    
+    @abstractmethod
+    def update_investment(self, investment_id, updates):
+        pass
+    
+    @abstractmethod
+    def remove_investment(self, investment_id):
+        pass
+    
+    @abstractmethod
+    def save_investment_changes(self, changed, removed_ids):
+        pass
+    
+    # Transactions
+    @abstractmethod
+    def get_all_transactions(self):
+        pass
+    
+    @abstractmethod
+    def save_transaction(self, transaction_data):
+        pass
+    
+    @abstractmethod
+    def save_transaction_batch(self, transactions):
+        """Record several transactions with a single write"""
+    
+    # History
+    @abstractmethod
+    def get_history_rows(self, start=None, end=None, user_id=None):
+        """Get history as a packed NumPy array of HistorySegmentStore.RECORD_DTYPE rows"""
+    
+    @abstractmethod
+    def save_history_batch(self, history_records):
+        pass
+    
+    @abstractmethod
+    def prune_history(self, cutoff):
+        """Remove raw history records from before cutoff. Returns how many were removed."""
+    
+    def get_all_history(self):
+        return HistorySegmentStore.to_records(self.get_history_rows())
+    
+    def get_history_range(self, start=None, end=None):
+        """Get history records with start <= recorded_at < end"""
+        return HistorySegmentStore.to_records(self.get_history_rows(start, end))
+    
+    def save_history(self, history_data):
+        history_data['recorded_at'] = datetime.now().isoformat()
+        return self.save_history_batch([history_data])
+    
+    def get_user_history(self, user_id, days=7):
+        rows = self.get_history_rows(time.time() - (days * 24 * 3600), user_id=user_id)
+        return HistorySegmentStore.to_records(rows)
+    
+    # Candles
+    @abstractmethod
+    def get_all_candles(self):
+        pass
+    
+    @abstractmethod
+    def save_candles(self, candles):
+        pass
+    
+    @abstractmethod
+    def remove_candles(self, keys):
+        pass
+    
+    # Spam tracking
+    @abstractmethod
+    def get_spam_data(self):
+        pass
+    
+    @abstractmethod
+    def save_spam_data(self, spam_data):
+        pass
+    
+    @abstractmethod
+    def update_user_spam_data(self, user_id, spam_data):
+        pass
+    
+    @abstractmethod
+    def update_spam_data_batch(self, spam_updates):
+        pass
+    
+    # Companies
+    @abstractmethod
+    def get_all_companies(self):
+        pass
+    
+    @abstractmethod
+    def get_company(self, company_id):
+        pass
+    
+    @abstractmethod
+    def save_company(self, company_data):
+        pass
+    
+    @abstractmethod
+    def save_companies(self, companies_data):
+        """Save {str(company_id): company} records, leaving other companies alone"""
+    
+    @abstractmethod
+    def update_company(self, company_id, updates):
+        pass
+    
+    @abstractmethod
+    def remove_company(self, company_id):
+        pass
+    
+    # Employees
+    @abstractmethod
+    def get_all_employees(self):
+        pass
+    
+    @abstractmethod
+    def get_employee(self, user_id):
+        pass
+    
+    @abstractmethod
+    def save_employee(self, employee_data):
+        pass
+    
+    @abstractmethod
+    def update_employee(self, user_id, updates):
+        pass
+    
+    @abstractmethod
+    def remove_employee(self, user_id):
+        pass
+    
+    @abstractmethod
+    def save_employee_changes(self, changed, removed_ids):
+        """Save {str(user_id): employee} records and remove the employees in removed_ids"""
+    
+    # Tasks
+    @abstractmethod
+    def get_all_tasks(self):
+        pass
+    
+    @abstractmethod
+    def get_company_tasks(self, company_id):
+        pass
+    
+    @abstractmethod
+    def save_company_tasks(self, company_id, tasks):
+        pass
+    
+    @abstractmethod
+    def save_tasks(self, tasks_data):
+        """Save {str(company_id): tasks} lists, leaving other companies' tasks alone"""
+    
+    @abstractmethod
+    def add_company_task(self, company_id, task_data):
+        pass
+    
+    @abstractmethod
+    def update_company_task(self, company_id, task_id, updates):
+        pass
+    
+    @abstractmethod
+    def remove_company_task(self, company_id, task_id):
+        pass
+    
+    # Deals
+    @abstractmethod
+    def get_all_deals(self):
+        pass
+    
+    @abstractmethod
+    def get_company_deals(self, company_id):
+        pass
+    
+    @abstractmethod
+    def save_company_deals(self, company_id, deals):
+        pass
+    
+    @abstractmethod
+    def save_deals(self, deals_data):
+        """Save {str(company_id): deals} lists, leaving other companies' deals alone"""
+    
+    @abstractmethod
+    def add_company_deal(self, company_id, deal_data):
+        pass
+    
+    @abstractmethod
+    def update_company_deal(self, company_id, deal_id, updates):
+        pass
+    
+    @abstractmethod
+    def remove_company_deal(self, company_id, deal_id):
+        pass
+
+
+def create_storage(backend=None):
+    """Create the storage engine named by config.STORAGE_BACKEND ('json' or 'sqlite')"""
+    backend = backend or config.STORAGE_BACKEND
+    # Imported here because both engines import this module for StorageBackend
+    if backend == 'json':
+        from data_handler import JSONDataHandler
+        return JSONDataHandler()
+    if backend == 'sqlite':
+        from database import SQLiteDataHandler
+        return SQLiteDataHandler()
+    raise ValueError(f"Unknown storage backend '{backend}', expected 'json' or 'sqlite'")
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from collections import OrderedDict
+import discord
+import config
+
+
+class UserResolver:
+    """Resolve user IDs to display names from the member, LRU and client caches, fetching the rest concurrently"""
+    
+    def __init__(self, max_size=None, ttl=None, max_concurrent=None):
+        self.max_size = max_size or config.USER_CACHE_SIZE
+        self.ttl = ttl or config.USER_CACHE_TTL
+        self.semaphore = asyncio.Semaphore(max_concurrent or config.USER_FETCH_CONCURRENCY)
+        self.names = OrderedDict()
+    
+    def _get_cached(self, user_id):
+        entry = self.names.get(user_id)
+        if entry is None:
+            return None
+        name, expires_at = entry
+        if expires_at < time.time():
+            del self.names[user_id]
+            return None
+        self.names.move_to_end(user_id)
+        return name
+    
+    def _cache(self, user_id, name):
+        self.names[user_id] = (name, time.time() + self.ttl)
+        self.names.move_to_end(user_id)
+        while len(self.names) > self.max_size:
+            self.names.popitem(last=False)
+    
+    async def _fetch_name(self, client, user_id):
+        async with self.semaphore:
+            try:
+                user = await client.fetch_user(user_id)
+                name = user.display_name
+            except discord.NotFound:
+                name = f"User_{user_id}"
+            except discord.HTTPException as e:
+                # Don't cache transient failures
+                print(f"Failed to fetch user {user_id}: {e}")
+                return f"User_{user_id}"
+        self._cache(user_id, name)
+        return name
+    
+    async def resolve_names(self, interaction: discord.Interaction, user_ids):
+        """Get a {user_id: display_name} mapping for the given users"""
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            member = interaction.guild.get_member(user_id) if interaction.guild else None
+            if member:
+                names[user_id] = member.display_name
+                self._cache(user_id, member.display_name)
+                continue
+            
+            name = self._get_cached(user_id)
+            if name is None:
+                user = interaction.client.get_user(user_id)
+                if user:
+                    name = user.display_name
+                    self._cache(user_id, name)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+        
+        # Fetch the rest at once, deferring first if there are enough that the
+        # 3-second response deadline could be missed
+        if missing:
+            if len(missing) > config.USER_FETCH_DEFER_THRESHOLD and not interaction.response.is_done():
+                await interaction.response.defer()
+            fetched = await asyncio.gather(*(self._fetch_name(interaction.client, user_id) for user_id in missing))
+            names.update(zip(missing, fetched))
+        
+        return names
@@ -46,4 +46,12 @@ def create_embed(title, description="", color=discord.Color.blue()):
         color=color,
         timestamp=datetime.now()
     )
-    return embed
\ No newline at end of file
+    return embed
+
+
+async def send_response(interaction, **kwargs):
+    """Send the interaction response, or a followup if it was deferred"""
+    if interaction.response.is_done():
+        await interaction.followup.send(**kwargs)
+    else:
+        await interaction.response.send_message(**kwargs)